@@ -4,14 +4,21 @@ Uses Sentence Transformers for embeddings and Ollama/HuggingFace for LLM.
 """
 from fastapi import FastAPI, UploadFile, File, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import ORJSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional, List
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import multiprocessing
 import os
+import shutil
 import sys
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
+import orjson
 
 # Load environment variables from .env file (optional for free version)
 BASE_DIR = Path(__file__).parent.parent
@@ -24,12 +31,15 @@ sys.path.append(str(BASE_DIR))
 
 from utils.pdf_extractor import extract_text_from_pdf
 from utils.text_processor import chunk_text
-from utils.embeddings_free import generate_embeddings_batch, generate_embedding, get_embedding_dimension
+from utils.embeddings_free import (generate_embeddings_batch, agenerate_embedding, get_embedding_dimension, warmup,
+                                   autosave_embedding_cache, flush_embedding_cache)
 from utils.vector_db import VectorDB
-from utils.gpt_client_free import generate_answer
+from utils.semantic_cache import SemanticCache
+from utils.gpt_client_free import agenerate_answer, is_cacheable_answer
 
 # Initialize FastAPI app
-app = FastAPI(title="AI Chatbot RAG API - FREE VERSION")
+# Serialize JSON responses with orjson (much faster than the stdlib json module)
+app = FastAPI(title="AI Chatbot RAG API - FREE VERSION", default_response_class=ORJSONResponse)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -40,13 +50,88 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger responses (CSS/JS, long answers)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Initialize vector database with FREE embedding dimension (384 instead of 1536)
 EMBEDDING_DIM = get_embedding_dimension()  # 384 for all-MiniLM-L6-v2
-vector_db = VectorDB(dimension=EMBEDDING_DIM, index_path=str(BASE_DIR / "data" / "faiss_index_free.pkl"))
+# VECTOR_INDEX_TYPE=flat gives exact brute-force search instead of HNSW;
+# VECTOR_INDEX_TYPE=sq8 stores int8-quantized vectors (4x less memory);
+# VECTOR_INDEX_TYPE=ivfpq compresses large collections with product quantization
+# VECTOR_USE_GPU=1 keeps a flat index on the GPU (requires faiss-gpu)
+vector_db = VectorDB(
+    dimension=EMBEDDING_DIM,
+    index_path=str(BASE_DIR / "data" / "faiss_index_free.pkl"),
+    index_type=os.getenv("VECTOR_INDEX_TYPE", "hnsw"),
+    use_gpu=os.getenv("VECTOR_USE_GPU") == "1"
+)
+
+# Answers to recent questions, reused for near-identical questions
+answer_cache = SemanticCache(dimension=EMBEDDING_DIM)
 
 # Ensure data directory exists
 os.makedirs(BASE_DIR / "data", exist_ok=True)
 
+# Process pool for CPU-bound document processing (PDF parsing, chunking).
+# Created on startup rather than at import time so worker processes are
+# never spawned while the module is being imported by a child process.
+cpu_pool: Optional[ProcessPoolExecutor] = None
+CPU_POOL_MAX_WORKERS = 4
+
+
+@app.on_event("startup")
+def start_cpu_pool():
+    """Start the process pool used by /upload."""
+    global cpu_pool
+    # Spawned rather than forked: this process already runs threads (executor,
+    # model runtimes) whose locks a forked child could inherit while held.
+    # Each worker imports the app's modules again, so only start a few.
+    cpu_pool = ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, CPU_POOL_MAX_WORKERS),
+                                   mp_context=multiprocessing.get_context("spawn"))
+
+
+@app.on_event("shutdown")
+def stop_cpu_pool():
+    """Shut down the process pool."""
+    if cpu_pool is not None:
+        cpu_pool.shutdown(wait=False, cancel_futures=True)
+
+
+@app.on_event("startup")
+async def preload_embedding_model():
+    """Load the embedding model in the background so the first request doesn't wait for it."""
+    asyncio.get_running_loop().run_in_executor(None, warmup)
+
+
+# Background tasks persisting the vector database and embedding cache, so /upload never waits on disk writes
+autosave_task: Optional[asyncio.Task] = None
+cache_autosave_task: Optional[asyncio.Task] = None
+
+
+@app.on_event("startup")
+async def start_autosave():
+    """Start periodically saving the vector database and embedding cache."""
+    global autosave_task, cache_autosave_task
+    autosave_task = asyncio.create_task(vector_db.autosave())
+    cache_autosave_task = asyncio.create_task(autosave_embedding_cache())
+
+
+@app.on_event("shutdown")
+async def stop_autosave():
+    """Stop the autosave tasks and write any pending changes."""
+    for task in (autosave_task, cache_autosave_task):
+        if task is not None:
+            task.cancel()
+    vector_db.flush()
+    flush_embedding_cache()
+
+
+def _save_upload(upload_file) -> str:
+    """Stream an uploaded file into a temporary file in the data directory."""
+    with tempfile.NamedTemporaryFile(dir=BASE_DIR / "data", suffix=".upload", delete=False) as f:
+        shutil.copyfileobj(upload_file, f, 1024 * 1024)
+        return f.name
+
 
 class QuestionRequest(BaseModel):
     """Request model for asking questions."""
@@ -59,35 +144,6 @@ class QuestionResponse(BaseModel):
     sources: List[str]  # Document excerpts used for the answer
 
 
-# Serve frontend static files (CSS, JS, etc.)
-frontend_path = BASE_DIR / "frontend"
-if frontend_path.exists():
-    app.mount("/static", StaticFiles(directory=str(frontend_path)), name="static")
-    
-    # Serve CSS and JS files
-    @app.get("/styles.css")
-    async def get_styles():
-        css_path = BASE_DIR / "frontend" / "styles.css"
-        if css_path.exists():
-            return FileResponse(css_path, media_type="text/css")
-        raise HTTPException(status_code=404, detail="CSS file not found")
-    
-    @app.get("/app.js")
-    async def get_app_js():
-        js_path = BASE_DIR / "frontend" / "app.js"
-        if js_path.exists():
-            return FileResponse(js_path, media_type="application/javascript")
-        raise HTTPException(status_code=404, detail="JS file not found")
-
-@app.get("/")
-def root():
-    """Root endpoint - serve frontend."""
-    index_path = BASE_DIR / "frontend" / "index.html"
-    if index_path.exists():
-        return FileResponse(index_path)
-    return {"message": "AI Chatbot RAG API (FREE VERSION) is running. Frontend not found."}
-
-
 @app.post("/upload")
 async def upload_document(file: UploadFile = File(...)):
     """
@@ -109,47 +165,44 @@ async def upload_document(file: UploadFile = File(...)):
                 detail=f"Unsupported file type: {file_ext}. Supported types: {allowed_extensions}"
             )
         
-        # Read file content
-        content = await file.read()
-        
-        if len(content) == 0:
-            raise HTTPException(status_code=400, detail="Uploaded file is empty")
-        
-        # Extract text based on file type
-        if file_ext == '.pdf':
-            text = extract_text_from_pdf(content)
-        else:  # .txt or .text
-            text = content.decode('utf-8')
-            if not text.strip():
-                raise HTTPException(status_code=400, detail="Text file is empty")
-        
-        # Process text: chunk it
-        chunks = chunk_text(text, chunk_size=1000, overlap=200)
-        
-        if not chunks:
-            raise HTTPException(status_code=400, detail="No text could be extracted from the file")
-        
-        # Generate embeddings for all chunks (FREE, local, no API costs)
-        print(f"Generating embeddings for {len(chunks)} chunks using FREE local model...")
-        embeddings = generate_embeddings_batch(chunks)
-        
-        # Prepare metadata for each chunk
-        metadata_list = [
-            {
-                "filename": file.filename,
-                "chunk_index": i,
-                "total_chunks": len(chunks)
-            }
-            for i in range(len(chunks))
-        ]
+        loop = asyncio.get_running_loop()
         
-        # Add to vector database
-        vector_db.add_documents(embeddings, chunks, metadata_list)
-        
-        # Save the uploaded file (optional, for reference)
-        file_path = BASE_DIR / "data" / file.filename
-        with open(file_path, "wb") as f:
-            f.write(content)
+        # Stream the upload to disk instead of reading the whole file into memory
+        upload_path = await loop.run_in_executor(None, _save_upload, file.file)
+        try:
+            if os.path.getsize(upload_path) == 0:
+                raise HTTPException(status_code=400, detail="Uploaded file is empty")
+            
+            # Extract text based on file type (off the event loop)
+            if file_ext == '.pdf':
+                text = await loop.run_in_executor(cpu_pool, extract_text_from_pdf, upload_path)
+            else:  # .txt or .text
+                text = await loop.run_in_executor(None, Path(upload_path).read_text, 'utf-8')
+                if not text.strip():
+                    raise HTTPException(status_code=400, detail="Text file is empty")
+            
+            # Process text: chunk it
+            chunks = await loop.run_in_executor(cpu_pool, chunk_text, text, 1000, 200)
+            
+            if not chunks:
+                raise HTTPException(status_code=400, detail="No text could be extracted from the file")
+            
+            # Generate embeddings for all chunks (FREE, local, no API costs).
+            # Runs in a thread rather than the process pool: torch releases the GIL
+            # during inference and the model stays loaded once in this process.
+            print(f"Generating embeddings for {len(chunks)} chunks using FREE local model...")
+            embeddings = await loop.run_in_executor(None, generate_embeddings_batch, chunks)
+            
+            # Add to vector database, in a thread: it waits for the lock while
+            # a save snapshots the database, and flat-to-HNSW switches take a while
+            await loop.run_in_executor(None, vector_db.add_documents, embeddings, chunks, file.filename, len(chunks))
+            answer_cache.clear()
+            
+            # Keep the uploaded file (optional, for reference)
+            os.replace(upload_path, BASE_DIR / "data" / file.filename)
+        finally:
+            if os.path.exists(upload_path):
+                os.remove(upload_path)
         
         return {
             "message": f"Document '{file.filename}' uploaded and processed successfully (FREE version - no API costs)",
@@ -189,10 +242,18 @@ async def ask_question(request: QuestionRequest):
             )
         
         # Generate embedding for the question (FREE, local)
-        question_embedding = generate_embedding(question)
+        question_embedding = await agenerate_embedding(question)
+        
+        # Reuse the answer to a semantically equivalent earlier question
+        generation = answer_cache.generation
+        cached = answer_cache.get(question_embedding)
+        if cached is not None:
+            answer, context_chunks = cached
+            return QuestionResponse(answer=answer, sources=context_chunks)
         
-        # Search for relevant document chunks
-        search_results = vector_db.search(question_embedding, k=3)
+        # Search for relevant document chunks (in a thread, as it may wait for
+        # an add or delete holding the database lock)
+        search_results = await asyncio.get_running_loop().run_in_executor(None, vector_db.search, question_embedding, 3)
         
         if not search_results:
             raise HTTPException(
@@ -206,7 +267,7 @@ async def ask_question(request: QuestionRequest):
         # Generate answer using FREE LLM (Ollama local or Hugging Face)
         # Try Ollama first, fallback to Hugging Face automatically
         try:
-            answer = generate_answer(question, context_chunks, use_ollama=True)
+            answer = await agenerate_answer(question, context_chunks, use_ollama=True)
         except Exception as e:
             # If both Ollama and Hugging Face fail, provide helpful error
             error_msg = str(e)
@@ -222,6 +283,11 @@ async def ask_question(request: QuestionRequest):
                 )
             raise
         
+        # Not temporary "model loading"/"rate limit" messages, which would
+        # otherwise be served for similar questions after the outage
+        if is_cacheable_answer(answer):
+            answer_cache.put(question_embedding, answer, context_chunks, generation=generation)
+        
         return QuestionResponse(
             answer=answer,
             sources=context_chunks
@@ -289,6 +355,7 @@ def delete_file(filename: str):
         
         # Delete from vector database
         chunks_deleted = vector_db.delete_documents_by_filename(filename)
+        answer_cache.clear()
         
         # Delete physical file from filesystem
         file_path = BASE_DIR / "data" / filename
@@ -310,6 +377,8 @@ def delete_file(filename: str):
     
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting file: {str(e)}")
 
@@ -324,6 +393,7 @@ def clear_database():
         
         # Clear vector database
         vector_db.clear()
+        answer_cache.clear()
         
         # Delete all files from filesystem
         deleted_files = []
@@ -344,3 +414,17 @@ def clear_database():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error clearing database: {str(e)}")
 
+
+# Serve the frontend (index.html, CSS, JS) with StaticFiles, which handles
+# ETag/304 and range requests. Mounted last so the API routes above take precedence.
+frontend_path = BASE_DIR / "frontend"
+if frontend_path.exists():
+    app.mount("/", StaticFiles(directory=str(frontend_path), html=True), name="frontend")
+else:
+    # Constant payload, serialized once
+    _ROOT_MESSAGE = orjson.dumps({"message": "AI Chatbot RAG API (FREE VERSION) is running. Frontend not found."})
+    
+    @app.get("/")
+    def root():
+        """Root endpoint - frontend not available."""
+        return Response(_ROOT_MESSAGE, media_type="application/json")
@@ -0,0 +1,137 @@
+"""
+Crash-injection tests for VectorDB persistence.
+"""
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import vector_db
+from utils.vector_db import VectorDB
+
+DIMENSION = 8
+
+
+def _unit_vectors(count: int, seed: int) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class InterruptedSaveTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.directory, "faiss_index.pkl")
+        self.a = _unit_vectors(10, seed=1)
+        self.b = _unit_vectors(5, seed=2)
+        
+        db = self._open()
+        db.add_documents(self.a, [f"a{i}" for i in range(10)], filename="a.txt")
+        db.add_documents(self.b, [f"b{i}" for i in range(5)], filename="b.txt")
+        db.flush()
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def _open(self) -> VectorDB:
+        return VectorDB(dimension=DIMENSION, index_path=self.index_path)
+    
+    def _assert_consistent(self, db: VectorDB, filenames):
+        self.assertEqual(db.size(), len(db.texts))
+        self.assertEqual(db.get_filenames(), filenames)
+        # Every query must find its own chunk
+        text, score, metadata = db.search(self.b[3], k=1)[0]
+        self.assertEqual(text, "b3")
+        self.assertEqual(metadata["filename"], "b.txt")
+    
+    def test_delete_then_crash_before_commit_keeps_old_files(self):
+        db = self._open()
+        self.assertEqual(db.delete_documents_by_filename("a.txt"), 10)
+        with mock.patch.object(vector_db.np, "save", side_effect=OSError("crash")):
+            with self.assertRaises(OSError):
+                db.flush()
+        
+        reloaded = self._open()
+        self.assertEqual(reloaded.size(), 15)
+        self._assert_consistent(reloaded, ["a.txt", "b.txt"])
+    
+    def test_delete_then_crash_after_commit_finishes_save(self):
+        db = self._open()
+        db.delete_documents_by_filename("a.txt")
+        with mock.patch.object(VectorDB, "_replace_files", side_effect=OSError("crash")):
+            with self.assertRaises(OSError):
+                db.flush()
+        
+        reloaded = self._open()
+        self.assertEqual(reloaded.size(), 5)
+        self._assert_consistent(reloaded, ["b.txt"])
+        
+        # The finished save is a normal database again
+        self.assertEqual(self._open().size(), 5)
+    
+    def test_read_only_reader_leaves_pending_save_to_writer(self):
+        db = self._open()
+        db.delete_documents_by_filename("a.txt")
+        with mock.patch.object(VectorDB, "_replace_files", side_effect=OSError("crash")):
+            with self.assertRaises(OSError):
+                db.flush()
+        files = sorted(os.listdir(self.directory))
+        
+        reader = VectorDB(dimension=DIMENSION, index_path=self.index_path, read_only=True)
+        self.assertEqual(reader.size(), 5)
+        self._assert_consistent(reader, ["b.txt"])
+        self.assertEqual(sorted(os.listdir(self.directory)), files)
+        
+        self.assertEqual(self._open().size(), 5)
+        self.assertFalse(any(name.endswith(".tmp") for name in os.listdir(self.directory)))
+    
+    def test_index_without_matching_texts_is_refused(self):
+        db = self._open()
+        db.delete_documents_by_filename("a.txt")
+        db.flush()
+        # Vectors from before the delete, without embeddings to rebuild from
+        os.remove(db._emb_file)
+        with mock.patch.object(vector_db.faiss, "read_index", return_value=self._old_index()):
+            with self.assertRaises(ValueError):
+                self._open()
+    
+    def _old_index(self):
+        index = vector_db.faiss.IndexFlatIP(DIMENSION)
+        index.add(np.concatenate([self.a, self.b]))
+        return index
+
+
+class LegacyL2IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.directory, "faiss_index.pkl")
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_l2_index_without_embeddings_ranks_by_distance(self):
+        # Raw (non-unit) vectors in an L2 index, texts in the pickle, no embeddings
+        vectors = _unit_vectors(20, seed=3) * np.random.default_rng(4).uniform(0.5, 5, (20, 1)).astype(np.float32)
+        index = vector_db.faiss.IndexFlatL2(DIMENSION)
+        index.add(vectors)
+        vector_db.faiss.write_index(index, self.index_path[:-len(".pkl")] + ".index")
+        with open(self.index_path, "wb") as f:
+            pickle.dump({"dimension": DIMENSION, "texts": [f"t{i}" for i in range(20)],
+                         "metadata": [{} for _ in range(20)]}, f)
+        
+        db = VectorDB(dimension=DIMENSION, index_path=self.index_path)
+        for i in range(20):
+            results = db.search(vectors[i], k=3)
+            self.assertEqual(results[0][0], f"t{i}")
+            scores = [score for _, score, _ in results]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+"""
+Utility module for caching text embeddings in memory and on disk.
+"""
+import asyncio
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Optional, Union
+from pathlib import Path
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    LRU cache of embeddings keyed by a content hash of (model, text).
+    
+    Shared by all callers and persisted to disk, so identical questions and
+    chunks (e.g. a re-uploaded document) are never embedded twice. New
+    entries are written by flush()/autosave(), not on every put().
+    """
+    
+    def __init__(self, path: Union[str, Path], max_entries: int = 10000):
+        """
+        Initialize the cache, loading previously saved entries.
+        
+        Args:
+            path: File the cache is persisted to
+            max_entries: Maximum number of embeddings kept (least recently used are evicted)
+        """
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # One save at a time
+        self._dirty = False
+        self._entries = self._load()
+    
+    @staticmethod
+    def key(text: str, model: str) -> bytes:
+        """Content hash identifying an embedding."""
+        return hashlib.sha256((model + "\x00" + text).encode("utf-8")).digest()
+    
+    def _load(self) -> "OrderedDict[bytes, np.ndarray]":
+        """Load the persisted cache, or start empty."""
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            if isinstance(data, tuple):
+                # (keys, matrix): each embedding is a row view of one array
+                keys, matrix = data
+                return OrderedDict(zip(keys, matrix))
+            # Older caches are a dict of arrays (or lists of floats)
+            return OrderedDict((key, np.asarray(embedding, dtype=np.float32))
+                               for key, embedding in data.items())
+        except FileNotFoundError:
+            return OrderedDict()
+        except Exception as e:
+            print(f"Warning: Could not load embedding cache: {e}")
+            return OrderedDict()
+    
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """Look up an embedding, marking it as recently used."""
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+            return embedding
+    
+    def put(self, key: bytes, embedding: np.ndarray):
+        """Store an embedding, evicting the least recently used entries."""
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+    
+    def save(self):
+        """Persist the cache to disk."""
+        with self._save_lock:
+            with self._lock:
+                keys = list(self._entries)
+                embeddings = list(self._entries.values())
+                self._dirty = False
+            try:
+                # One (N, dimension) matrix pickles as a single buffer instead of
+                # N small array objects
+                data = (keys, np.stack(embeddings))
+            except ValueError:
+                data = dict(zip(keys, embeddings))  # Empty, or embeddings of different dimensions
+            tmp_path = None
+            try:
+                os.makedirs(self.path.parent, exist_ok=True)
+                # A unique file next to the cache, so the rename is atomic and
+                # other processes saving the same cache never share it
+                with tempfile.NamedTemporaryFile("wb", dir=self.path.parent, prefix=self.path.name + ".",
+                                                 suffix=".tmp", delete=False) as f:
+                    tmp_path = f.name
+                    pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                self._dirty = True
+                print(f"Warning: Could not save embedding cache: {e}")
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+    
+    def flush(self):
+        """Save to disk if there are unsaved entries."""
+        if self._dirty:
+            self.save()
+    
+    async def autosave(self, interval: float = 30.0):
+        """
+        Periodically flush new entries in a worker thread.
+        
+        Run as a background task; entries are batched so requests never wait
+        on pickling the cache.
+        
+        Args:
+            interval: Seconds between flushes
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if self._dirty:
+                await loop.run_in_executor(None, self.flush)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -2,8 +2,14 @@
 Utility module for generating text embeddings using OpenAI API.
 """
 import openai
-from typing import List, Optional
+from pathlib import Path
+from typing import Dict, List, Optional
+import asyncio
+import base64
 import os
+import numpy as np
+
+from utils.embedding_cache import EmbeddingCache
 
 
 def initialize_openai(api_key: Optional[str] = None):
@@ -25,7 +31,75 @@ def initialize_openai(api_key: Optional[str] = None):
     openai.api_key = api_key
 
 
-def generate_embedding(text: str, model: str = "text-embedding-3-small") -> List[float]:
+# Shared client instances, created on first use so that connection pools
+# (and TLS sessions) are reused across requests
+_client = None
+_async_client = None
+
+
+def _get_api_key() -> str:
+    """Read the OpenAI API key from the environment."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not found in environment variables")
+    return api_key
+
+
+def _get_client():
+    """Lazy load the synchronous OpenAI client."""
+    global _client
+    if _client is None:
+        from openai import OpenAI
+        # Initialize client without proxies parameter
+        _client = OpenAI(api_key=_get_api_key())
+    return _client
+
+
+def _get_async_client():
+    """Lazy load the asynchronous OpenAI client."""
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=_get_api_key())
+    return _async_client
+
+
+# Embedding cache keyed by sha256(model + text), shared by all callers and
+# persisted to disk so identical questions/chunks are never embedded twice
+_cache = EmbeddingCache(Path(__file__).parent.parent / "data" / "emb_cache.pkl")
+
+
+def flush_embedding_cache():
+    """Persist the embedding cache to disk if it has new entries."""
+    _cache.flush()
+
+
+async def autosave_embedding_cache(interval: float = 30.0):
+    """Periodically persist new embedding cache entries (run as a background task)."""
+    await _cache.autosave(interval)
+
+
+def _api_error_to_value_error(e: Exception) -> ValueError:
+    """Convert an OpenAI APIError into a ValueError with a readable message."""
+    if getattr(e, "status_code", None) == 429:
+        if "insufficient_quota" in str(e) or "quota" in str(e).lower():
+            return ValueError(
+                "OpenAI API quota exceeded. Please check your OpenAI account billing and quota. "
+                "Visit https://platform.openai.com/account/billing to add credits or upgrade your plan."
+            )
+        return ValueError(
+            f"OpenAI API rate limit exceeded. Please try again in a few moments. "
+            f"Error: {str(e)}"
+        )
+    return ValueError(f"OpenAI API error: {str(e)}")
+
+
+def _decode_embedding(item) -> np.ndarray:
+    """Decode a base64-encoded embedding from the API into a float32 vector."""
+    return np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32)
+
+
+def generate_embedding(text: str, model: str = "text-embedding-3-small") -> np.ndarray:
     """
     Generate embedding for a single text string.
     
@@ -34,82 +108,234 @@ def generate_embedding(text: str, model: str = "text-embedding-3-small") -> List
         model: OpenAI embedding model to use
         
     Returns:
-        List of float values representing the embedding
+        float32 array representing the embedding
     """
+    key = EmbeddingCache.key(text, model)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    
+    from openai import APIError
     try:
-        from openai import OpenAI
-        from openai import APIError
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        
-        # Initialize client without proxies parameter
-        client = OpenAI(api_key=api_key)
+        response = _get_client().embeddings.create(
+            model=model,
+            input=text,
+            encoding_format="base64"
+        )
+        embedding = _decode_embedding(response.data[0])
+        _cache.put(key, embedding)
+        return embedding
+    except APIError as e:
+        raise _api_error_to_value_error(e)
+    except Exception as e:
+        raise ValueError(f"Error generating embedding: {str(e)}")
+
+
+async def agenerate_embedding(text: str, model: str = "text-embedding-3-small") -> np.ndarray:
+    """
+    Async version of generate_embedding, for use inside request handlers.
+    
+    Args:
+        text: Text to embed
+        model: OpenAI embedding model to use
         
-        response = client.embeddings.create(
+    Returns:
+        float32 array representing the embedding
+    """
+    key = EmbeddingCache.key(text, model)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    
+    from openai import APIError
+    try:
+        response = await _get_async_client().embeddings.create(
             model=model,
-            input=text
+            input=text,
+            encoding_format="base64"
         )
-        return response.data[0].embedding
+        embedding = _decode_embedding(response.data[0])
+        _cache.put(key, embedding)
+        return embedding
     except APIError as e:
-        if e.status_code == 429:
-            if "insufficient_quota" in str(e) or "quota" in str(e).lower():
-                raise ValueError(
-                    "OpenAI API quota exceeded. Please check your OpenAI account billing and quota. "
-                    "Visit https://platform.openai.com/account/billing to add credits or upgrade your plan."
-                )
-            else:
-                raise ValueError(
-                    f"OpenAI API rate limit exceeded. Please try again in a few moments. "
-                    f"Error: {str(e)}"
-                )
-        else:
-            raise ValueError(f"OpenAI API error: {str(e)}")
+        raise _api_error_to_value_error(e)
     except Exception as e:
         raise ValueError(f"Error generating embedding: {str(e)}")
 
 
-def generate_embeddings_batch(texts: List[str], model: str = "text-embedding-3-small") -> List[List[float]]:
+def generate_embeddings_batch(texts: List[str], model: str = "text-embedding-3-small") -> np.ndarray:
     """
     Generate embeddings for multiple texts efficiently.
     
+    Cached texts are served from the embedding cache, and duplicate texts
+    within the batch are sent to the API only once.
+    
     Args:
         texts: List of texts to embed
         model: OpenAI embedding model to use
         
     Returns:
-        List of embeddings (each is a list of floats)
+        (len(texts), dimension) float32 array of embeddings
     """
+    keys = [EmbeddingCache.key(text, model) for text in texts]
+    embeddings = [_cache.get(key) for key in keys]
+    
+    # Unique texts that still need embedding, in first-seen order
+    missing: Dict[bytes, str] = {}
+    for key, text, embedding in zip(keys, texts, embeddings):
+        if embedding is None and key not in missing:
+            missing[key] = text
+    
+    if not missing:
+        return np.vstack(embeddings)
+    
+    from openai import APIError
     try:
-        from openai import OpenAI
-        from openai import APIError
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not found in environment variables")
-        
-        # Initialize client without proxies parameter
-        client = OpenAI(api_key=api_key)
-        
         # OpenAI API supports batch processing
-        response = client.embeddings.create(
+        response = _get_client().embeddings.create(
             model=model,
-            input=texts
+            input=list(missing.values()),
+            encoding_format="base64"  # Raw float32 bytes instead of JSON float lists
         )
-        return [item.embedding for item in response.data]
+        fetched = {key: _decode_embedding(item) for key, item in zip(missing, response.data)}
     except APIError as e:
-        if e.status_code == 429:
-            if "insufficient_quota" in str(e) or "quota" in str(e).lower():
-                raise ValueError(
-                    "OpenAI API quota exceeded. Please check your OpenAI account billing and quota. "
-                    "Visit https://platform.openai.com/account/billing to add credits or upgrade your plan."
-                )
-            else:
-                raise ValueError(
-                    f"OpenAI API rate limit exceeded. Please try again in a few moments. "
-                    f"Error: {str(e)}"
-                )
-        else:
-            raise ValueError(f"OpenAI API error: {str(e)}")
+        raise _api_error_to_value_error(e)
     except Exception as e:
         raise ValueError(f"Error generating embeddings: {str(e)}")
+    
+    for key, embedding in fetched.items():
+        _cache.put(key, embedding)
+    
+    return np.vstack([embedding if embedding is not None else fetched[key]
+                      for key, embedding in zip(keys, embeddings)])
+
 
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent single-text embedding requests into batched API calls.
+    
+    Requests arriving within a short window are sent to OpenAI as one
+    embeddings call, amortizing the per-request network overhead.
+    """
+    
+    def __init__(self, model: str = "text-embedding-3-small",
+                 max_batch: int = 64, max_wait: float = 0.008):
+        """
+        Initialize the batcher.
+        
+        Args:
+            model: OpenAI embedding model to use
+            max_batch: Maximum number of texts sent in one API call
+            max_wait: Seconds to wait for more requests before sending a batch
+        """
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending = set()  # In-flight API calls
+        self._waiting = set()  # Futures of callers waiting for an embedding
+        self._stopped = False
+    
+    def start(self):
+        """Start the background batching task (call from the running event loop)."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+            self._stopped = False
+    
+    async def stop(self):
+        """
+        Stop the background batching task.
+        
+        Queued and in-flight requests fail with RuntimeError, and so do
+        later calls to embed(), so no caller waits on a stopped batcher.
+        """
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._pending):
+            task.cancel()
+        
+        # Fail the queued requests, the batch being collected and the batches in flight
+        if self._queue is not None:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+        for future in list(self._waiting):
+            if not future.done():
+                future.set_exception(RuntimeError("embedding batcher stopped"))
+    
+    async def embed(self, text: str) -> np.ndarray:
+        """
+        Generate embedding for a single text, batched with concurrent callers.
+        
+        Args:
+            text: Text to embed
+            
+        Returns:
+            float32 array representing the embedding
+            
+        Raises:
+            RuntimeError: If the batcher was stopped
+        """
+        if self._stopped:
+            raise RuntimeError("embedding batcher stopped")
+        
+        cached = _cache.get(EmbeddingCache.key(text, self.model))
+        if cached is not None:
+            return cached
+        
+        if self._task is None:
+            # Batcher not running (e.g. outside the app) - embed directly
+            return await agenerate_embedding(text, self.model)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.add(future)
+        future.add_done_callback(self._waiting.discard)
+        await self._queue.put((text, future))
+        return await future
+    
+    async def _run(self):
+        """Collect queued requests into batches and dispatch them."""
+        while True:
+            batch = [await self._queue.get()]
+            # Give concurrent requests a moment to join this batch
+            await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            task = asyncio.create_task(self._embed_batch(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+    
+    async def _embed_batch(self, batch):
+        """Embed one batch and resolve the waiting futures."""
+        from openai import APIError
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            response = await _get_async_client().embeddings.create(
+                model=self.model,
+                input=texts,
+                encoding_format="base64"
+            )
+            results = {text: _decode_embedding(item) for text, item in zip(texts, response.data)}
+        except Exception as e:
+            if isinstance(e, APIError):
+                error = _api_error_to_value_error(e)
+            else:
+                error = ValueError(f"Error generating embedding: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        
+        for text, embedding in results.items():
+            _cache.put(EmbeddingCache.key(text, self.model), embedding)
+        for text, future in batch:
+            if not future.done():
+                future.set_result(results[text])
@@ -2,22 +2,96 @@
 Free utility module for generating text embeddings using Sentence Transformers (local, no API costs).
 """
 from typing import List
+from pathlib import Path
+import asyncio
+import atexit
+import contextlib
 import os
+import threading
+import numpy as np
+
+from utils.embedding_cache import EmbeddingCache
 
 
 # Global model instance to avoid reloading
 _model = None
+_model_lock = threading.Lock()  # Loaded once even if several threads ask at startup
 _model_name = "all-MiniLM-L6-v2"  # Free, lightweight, 384-dimensional embeddings
 
+# Inference backend: "onnx" (default, int8-quantized ONNX Runtime graph), "openvino"
+# (int8-quantized OpenVINO graph) or "torch" (fp32). The quantized backends need
+# `pip install "sentence-transformers[onnx]"` / `"sentence-transformers[openvino]"`;
+# if they are unavailable the model is loaded with PyTorch instead.
+_backend = os.getenv("EMBEDDING_BACKEND", "onnx").lower()
+_onnx_file = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+_openvino_file = os.getenv("EMBEDDING_OPENVINO_FILE", "openvino/openvino_model_qint8_quantized.xml")
+
+# Intra-op threads used by PyTorch for inference (its default of one per core
+# oversubscribes the CPU when requests run in parallel)
+_num_threads = int(os.getenv("EMB_THREADS", min(os.cpu_count() or 1, 8)))
+
+# Batches larger than this are spread over a pool of encoding processes
+# (one per GPU, or several CPU workers), when more than one is available
+_MULTI_PROCESS_MIN_TEXTS = 256
+_pool = None
+_pool_lock = threading.Lock()
+
+# Embedding cache keyed by sha256(model + text), persisted to disk so
+# re-uploaded documents and repeated questions skip the model entirely. The
+# backend and graph file of the loaded model are part of the model key:
+# quantized graphs produce different embeddings than the fp32 model.
+_cache = EmbeddingCache(Path(__file__).parent.parent / "data" / "emb_cache_free.pkl")
+_cache_model = None  # Set by _get_model() once the model (or its fallback) is loaded
+
+
+def flush_embedding_cache():
+    """Persist the embedding cache to disk if it has new entries."""
+    _cache.flush()
+
+
+async def autosave_embedding_cache(interval: float = 30.0):
+    """Periodically persist new embedding cache entries (run as a background task)."""
+    await _cache.autosave(interval)
+
 
 def _get_model():
     """Lazy load the sentence transformer model."""
-    global _model
-    if _model is None:
+    global _model, _cache_model
+    if _model is not None:
+        return _model
+    
+    with _model_lock:
+        if _model is not None:
+            return _model
         try:
             from sentence_transformers import SentenceTransformer
             print(f"Loading embedding model: {_model_name} (first time only, this may take a minute)...")
-            _model = SentenceTransformer(_model_name)
+            model = None
+            if _backend in ("onnx", "openvino"):
+                if _backend == "onnx":
+                    model_kwargs = {"file_name": _onnx_file, "provider": "CPUExecutionProvider"}
+                else:
+                    model_kwargs = {"file_name": _openvino_file}
+                try:
+                    model = SentenceTransformer(
+                        _model_name,
+                        backend=_backend,
+                        model_kwargs=model_kwargs
+                    )
+                except Exception as e:
+                    print(f"Warning: Could not load {_backend} model ({e}), falling back to PyTorch")
+            if model is None:
+                model = SentenceTransformer(_model_name)
+                _tune_torch_model(model)
+            _ensure_fast_tokenizer(model)
+            # Run one encode so the first request doesn't pay for lazy initialization
+            model.encode("warmup", convert_to_numpy=True)
+            # Key the cache by the backend that actually loaded, not the
+            # configured one (which may have fallen back to PyTorch)
+            backend = getattr(model, "backend", "torch")
+            model_file = {"onnx": _onnx_file, "openvino": _openvino_file}.get(backend)
+            _cache_model = f"{_model_name}:{backend}:{model_file}" if model_file else f"{_model_name}:{backend}"
+            _model = model
             print("Model loaded successfully!")
         except ImportError:
             raise ImportError(
@@ -26,12 +100,105 @@ def _get_model():
     return _model
 
 
+def _ensure_fast_tokenizer(model):
+    """Swap a slow Python tokenizer for the Rust-backed fast one."""
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None or getattr(tokenizer, "is_fast", True):
+        return
+    try:
+        from transformers import AutoTokenizer
+        model.tokenizer = AutoTokenizer.from_pretrained(tokenizer.name_or_path, use_fast=True)
+    except Exception as e:
+        print(f"Warning: Could not load fast tokenizer ({e}), using slow tokenizer")
+
+
+def _tune_torch_model(model):
+    """Set PyTorch thread counts and use half precision on GPU."""
+    import torch
+    torch.set_num_threads(_num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Can only be set before any inter-op parallel work has started
+    if model.device.type == "cuda":
+        model.half()  # fp16 runs on tensor cores and halves memory traffic
+
+
+def _get_pool(model):
+    """
+    Lazily start the multi-process encoding pool.
+    
+    Returns:
+        The pool, or None if a single process is the better choice (one GPU,
+        few CPU cores, or a non-PyTorch backend)
+    """
+    global _pool
+    if getattr(model, "backend", "torch") != "torch":
+        return None
+    
+    with _pool_lock:
+        if _pool is None:
+            import torch
+            if torch.cuda.is_available():
+                devices = [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+            else:
+                devices = ["cpu"] * min(4, (os.cpu_count() or 1) // 2)
+            if len(devices) < 2:
+                return None
+            print(f"Starting embedding worker pool on {len(devices)} devices...")
+            with _single_threaded_workers(devices):
+                _pool = model.start_multi_process_pool(target_devices=devices)
+            atexit.register(model.stop_multi_process_pool, _pool)
+        return _pool
+
+
+@contextlib.contextmanager
+def _single_threaded_workers(devices: List[str]):
+    """
+    Start CPU pool workers with one OpenMP/MKL thread each.
+    
+    The workers are spawned processes that read these variables when torch
+    loads; by default each would start a thread per core, oversubscribing
+    the CPU by the number of workers. The parent's environment is restored.
+    """
+    names = ("OMP_NUM_THREADS", "MKL_NUM_THREADS")
+    saved = {name: os.environ.get(name) for name in names}
+    if "cpu" in devices:
+        for name in names:
+            os.environ[name] = "1"
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _inference_mode():
+    """Context manager disabling autograd tracking while encoding."""
+    try:
+        import torch
+        return torch.inference_mode()
+    except ImportError:
+        return contextlib.nullcontext()
+
+
+def warmup():
+    """Load the model ahead of the first request (e.g. from a startup hook)."""
+    try:
+        _get_model()
+    except Exception as e:
+        print(f"Warning: Could not preload embedding model: {e}")
+
+
 def get_embedding_dimension() -> int:
     """Get the dimension of embeddings produced by the current model."""
     return 384  # all-MiniLM-L6-v2 produces 384-dimensional embeddings
 
 
-def generate_embedding(text: str, model: str = None) -> List[float]:
+def generate_embedding(text: str, model: str = None) -> np.ndarray:
     """
     Generate embedding for a single text string using Sentence Transformers (FREE, local).
     
@@ -40,31 +207,90 @@ def generate_embedding(text: str, model: str = None) -> List[float]:
         model: Ignored (kept for compatibility), uses local Sentence Transformer model
         
     Returns:
-        List of float values representing the embedding (384 dimensions)
+        float32 array representing the embedding (384 dimensions)
     """
     try:
+        # Loaded first: the cache key depends on the backend it loaded with
         model = _get_model()
-        embedding = model.encode(text, convert_to_numpy=True)
-        return embedding.tolist()
+    except Exception as e:
+        raise ValueError(f"Error generating embedding: {str(e)}")
+    
+    key = EmbeddingCache.key(text, _cache_model)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    
+    try:
+        with _inference_mode():
+            embedding = model.encode(text, convert_to_numpy=True).astype(np.float32, copy=False)
+        _cache.put(key, embedding)
+        return embedding
     except Exception as e:
         raise ValueError(f"Error generating embedding: {str(e)}")
 
 
-def generate_embeddings_batch(texts: List[str], model: str = None) -> List[List[float]]:
+async def agenerate_embedding(text: str, model: str = None) -> np.ndarray:
+    """
+    Async version of generate_embedding; runs the model in a worker thread
+    so the event loop stays free during inference.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, generate_embedding, text)
+
+
+def generate_embeddings_batch(texts: List[str], model: str = None, batch_size: int = 64) -> np.ndarray:
     """
     Generate embeddings for multiple texts efficiently using Sentence Transformers (FREE, local).
     
+    Cached texts are served from the embedding cache, and duplicate texts
+    (repeated headers, footers, template pages) are encoded once.
+    SentenceTransformer.encode sorts the texts by length before batching, so
+    each batch is padded only to similar-length texts.
+    
     Args:
         texts: List of texts to embed
         model: Ignored (kept for compatibility), uses local Sentence Transformer model
+        batch_size: Number of texts per forward pass (tune for CPU/GPU memory)
         
     Returns:
-        List of embeddings (each is a list of 384 floats)
+        (len(texts), 384) float32 array of embeddings
     """
+    if not texts:
+        return np.empty((0, get_embedding_dimension()), dtype=np.float32)
+    
     try:
+        # Loaded first: the cache key depends on the backend it loaded with
         model = _get_model()
-        embeddings = model.encode(texts, convert_to_numpy=True, show_progress_bar=False)
-        return embeddings.tolist()
     except Exception as e:
         raise ValueError(f"Error generating embeddings: {str(e)}")
+    
+    keys = [EmbeddingCache.key(text, _cache_model) for text in texts]
+    embeddings = [_cache.get(key) for key in keys]
+    
+    # Unique texts that still need encoding, in first-seen order
+    missing = {}
+    for key, text, embedding in zip(keys, texts, embeddings):
+        if embedding is None and key not in missing:
+            missing[key] = text
+    
+    if missing:
+        try:
+            pool = _get_pool(model) if len(missing) > _MULTI_PROCESS_MIN_TEXTS else None
+            with _inference_mode():
+                if pool is not None:
+                    encoded = model.encode_multi_process(list(missing.values()), pool, batch_size=batch_size)
+                else:
+                    encoded = model.encode(list(missing.values()), batch_size=batch_size,
+                                           convert_to_numpy=True, show_progress_bar=False)
+        except Exception as e:
+            raise ValueError(f"Error generating embeddings: {str(e)}")
+        
+        # float32 even when the model runs in fp16
+        fetched = dict(zip(missing, encoded.astype(np.float32, copy=False)))
+        for key, embedding in fetched.items():
+            _cache.put(key, embedding)
+        embeddings = [embedding if embedding is not None else fetched[key]
+                      for key, embedding in zip(keys, embeddings)]
+    
+    return np.vstack(embeddings)
 
@@ -5,6 +5,56 @@ from openai import OpenAI
 import os
 from typing import List, Optional
 
+from utils.prompts import SYSTEM_PROMPT, build_prompt
+
+
+# Shared async client, reused across requests to keep connections warm
+_async_client = None
+
+
+def _get_api_key(api_key: Optional[str]) -> str:
+    """Resolve the OpenAI API key from the argument or environment."""
+    if api_key is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+    
+    if not api_key:
+        raise ValueError(
+            "OpenAI API key not found. Please set OPENAI_API_KEY environment variable."
+        )
+    return api_key
+
+
+def _get_async_client(api_key: str):
+    """Lazy load the asynchronous OpenAI client for the given API key."""
+    global _async_client
+    if _async_client is None or _async_client.api_key != api_key:
+        from openai import AsyncOpenAI
+        _async_client = AsyncOpenAI(api_key=api_key)
+    return _async_client
+
+
+def _build_messages(question: str, context_chunks: List[str]) -> List[dict]:
+    """Build the chat messages for a RAG question."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": build_prompt(question, context_chunks)}
+    ]
+
+
+def _api_error_to_value_error(e: Exception) -> ValueError:
+    """Convert an OpenAI APIError into a ValueError with a readable message."""
+    if getattr(e, "status_code", None) == 429:
+        if "insufficient_quota" in str(e) or "quota" in str(e).lower():
+            return ValueError(
+                "OpenAI API quota exceeded. Please check your OpenAI account billing and quota. "
+                "Visit https://platform.openai.com/account/billing to add credits or upgrade your plan."
+            )
+        return ValueError(
+            f"OpenAI API rate limit exceeded. Please try again in a few moments. "
+            f"Error: {str(e)}"
+        )
+    return ValueError(f"OpenAI API error: {str(e)}")
+
 
 def generate_answer(question: str, context_chunks: List[str], 
                    api_key: Optional[str] = None,
@@ -21,41 +71,50 @@ def generate_answer(question: str, context_chunks: List[str],
     Returns:
         Generated answer as a string
     """
-    if api_key is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-    
-    if not api_key:
-        raise ValueError(
-            "OpenAI API key not found. Please set OPENAI_API_KEY environment variable."
-        )
+    api_key = _get_api_key(api_key)
     
     # Initialize client without proxies parameter - only pass api_key
     client = OpenAI(api_key=api_key)
     
-    # Combine context chunks
-    context = "\n\n".join([f"[Document Excerpt {i+1}]:\n{chunk}" 
-                           for i, chunk in enumerate(context_chunks)])
-    
-    # Create the prompt
-    system_prompt = """You are a helpful AI assistant that answers questions based on the provided document context.
-    Use only the information from the context to answer questions. If the context doesn't contain 
-    enough information to answer the question, say so clearly. Be concise and accurate."""
+    try:
+        from openai import APIError
+        response = client.chat.completions.create(
+            model=model,
+            messages=_build_messages(question, context_chunks),
+            temperature=0.7,
+            max_tokens=500
+        )
+        
+        return response.choices[0].message.content.strip()
     
-    user_prompt = f"""Context from documents:
-{context}
+    except APIError as e:
+        raise _api_error_to_value_error(e)
+    except Exception as e:
+        raise ValueError(f"Error generating answer with GPT: {str(e)}")
 
-Question: {question}
 
-Please provide an answer based on the context above."""
+async def agenerate_answer(question: str, context_chunks: List[str], 
+                           api_key: Optional[str] = None,
+                           model: str = "gpt-3.5-turbo") -> str:
+    """
+    Async version of generate_answer, for use inside request handlers.
+    
+    Args:
+        question: The user's question
+        context_chunks: List of relevant document chunks retrieved from vector DB
+        api_key: OpenAI API key (if None, reads from OPENAI_API_KEY env var)
+        model: GPT model to use
+        
+    Returns:
+        Generated answer as a string
+    """
+    client = _get_async_client(_get_api_key(api_key))
     
     try:
         from openai import APIError
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=_build_messages(question, context_chunks),
             temperature=0.7,
             max_tokens=500
         )
@@ -63,19 +122,6 @@ Please provide an answer based on the context above."""
         return response.choices[0].message.content.strip()
     
     except APIError as e:
-        if e.status_code == 429:
-            if "insufficient_quota" in str(e) or "quota" in str(e).lower():
-                raise ValueError(
-                    "OpenAI API quota exceeded. Please check your OpenAI account billing and quota. "
-                    "Visit https://platform.openai.com/account/billing to add credits or upgrade your plan."
-                )
-            else:
-                raise ValueError(
-                    f"OpenAI API rate limit exceeded. Please try again in a few moments. "
-                    f"Error: {str(e)}"
-                )
-        else:
-            raise ValueError(f"OpenAI API error: {str(e)}")
+        raise _api_error_to_value_error(e)
     except Exception as e:
         raise ValueError(f"Error generating answer with GPT: {str(e)}")
-
@@ -1,9 +1,39 @@
 """
 Free utility module for generating answers using Ollama or Hugging Face Inference API (no OpenAI costs).
 """
+import asyncio
 import os
 from typing import List, Optional
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+
+from utils.prompts import SYSTEM_PROMPT, build_prompt
+
+
+# Shared async Ollama client, reused across requests
+_ollama_async_client = None
+
+# Shared async HTTP client for the Hugging Face API (HTTP/2, pooled connections)
+_hf_async_client = None
+
+# Shared session for synchronous Hugging Face requests, so TCP/TLS connections
+# are kept alive and reused instead of reconnecting on every call
+_hf_session = requests.Session()
+_hf_session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
+# Returned in place of an answer while the Hugging Face API is temporarily
+# unavailable; never cached (see is_cacheable_answer)
+_MODEL_LOADING_ANSWER = "The model is loading, please try again in a few seconds. Please wait and try again."
+_RATE_LIMITED_ANSWER = "Rate limit exceeded. Please try again in a few moments."
+
+
+def is_cacheable_answer(answer: str) -> bool:
+    """
+    Whether an answer returned by generate_answer/agenerate_answer is a real
+    generation that may be cached, rather than a temporary-outage message.
+    """
+    return answer not in (_MODEL_LOADING_ANSWER, _RATE_LIMITED_ANSWER)
 
 
 def generate_answer(question: str, context_chunks: List[str], 
@@ -21,21 +51,7 @@ def generate_answer(question: str, context_chunks: List[str],
     Returns:
         Generated answer as a string
     """
-    # Combine context chunks
-    context = "\n\n".join([f"[Document Excerpt {i+1}]:\n{chunk}" 
-                           for i, chunk in enumerate(context_chunks)])
-    
-    # Create the prompt
-    prompt = f"""You are a helpful AI assistant that answers questions based on the provided document context.
-Use only the information from the context to answer questions. If the context doesn't contain 
-enough information to answer the question, say so clearly. Be concise and accurate.
-
-Context from documents:
-{context}
-
-Question: {question}
-
-Please provide an answer based on the context above."""
+    prompt = _create_prompt(question, context_chunks)
     
     # Try Ollama first if requested, or if Hugging Face will likely fail
     if use_ollama:
@@ -70,6 +86,85 @@ Please provide an answer based on the context above."""
                 )
 
 
+async def agenerate_answer(question: str, context_chunks: List[str], 
+                           model: str = "llama3.2",
+                           use_ollama: bool = True) -> str:
+    """
+    Async version of generate_answer, for use inside request handlers.
+    
+    Ollama and Hugging Face are called through async HTTP clients. Arguments
+    and fallback behaviour match generate_answer.
+    """
+    prompt = _create_prompt(question, context_chunks)
+    
+    if use_ollama:
+        try:
+            return await _agenerate_with_ollama(prompt, model)
+        except Exception as e:
+            print(f"Ollama error: {e}")
+            print("Falling back to Hugging Face...")
+            try:
+                return await _agenerate_with_huggingface(prompt, "HuggingFaceH4/zephyr-7b-beta")
+            except:
+                raise ValueError(
+                    "Neither Ollama nor Hugging Face API is available. "
+                    "Please install Ollama (https://ollama.ai/) and run 'ollama pull llama3.2' "
+                    "for free local LLM access."
+                )
+    else:
+        try:
+            return await _agenerate_with_huggingface(prompt, "HuggingFaceH4/zephyr-7b-beta")
+        except Exception as e:
+            print("Hugging Face failed, trying Ollama...")
+            try:
+                return await _agenerate_with_ollama(prompt, model="llama3.2")
+            except:
+                raise ValueError(
+                    f"Hugging Face API error: {str(e)}. "
+                    "Please install Ollama (https://ollama.ai/) and run 'ollama pull llama3.2' "
+                    "for free local LLM access."
+                )
+
+
+async def generate_answers_batch(questions: List[str], contexts: List[List[str]],
+                                 model: str = "llama3.2",
+                                 use_ollama: bool = True) -> List[str]:
+    """
+    Generate answers for several questions concurrently.
+    
+    The requests are issued together over the shared async clients; set
+    OLLAMA_NUM_PARALLEL on the Ollama server to let it process them in parallel.
+    
+    Args:
+        questions: The user's questions
+        contexts: Retrieved document chunks for each question
+        model: Model name (see generate_answer)
+        use_ollama: If True, use Ollama (local). If False, use Hugging Face Inference API
+        
+    Returns:
+        Generated answers, in the order of the questions
+    """
+    if len(questions) != len(contexts):
+        raise ValueError("Number of questions must match number of contexts")
+    
+    return list(await asyncio.gather(*(
+        agenerate_answer(question, context_chunks, model=model, use_ollama=use_ollama)
+        for question, context_chunks in zip(questions, contexts)
+    )))
+
+
+def _ollama_response_text(response) -> str:
+    """Extract the generated text from an Ollama generate response."""
+    # Handle different response formats
+    if isinstance(response, dict):
+        if "response" in response:
+            return response["response"].strip()
+        elif "text" in response:
+            return response["text"].strip()
+    
+    return str(response).strip()
+
+
 def _generate_with_ollama(prompt: str, model: str = "llama3.2") -> str:
     """
     Generate answer using Ollama (local, free).
@@ -86,18 +181,12 @@ def _generate_with_ollama(prompt: str, model: str = "llama3.2") -> str:
             prompt=prompt,
             options={
                 "temperature": 0.7,
-                "num_predict": 500
+                "num_predict": 500,
+                "num_ctx": 4096  # Fixed context size, so the loaded model (and its prompt cache) is reused
             }
         )
         
-        # Handle different response formats
-        if isinstance(response, dict):
-            if "response" in response:
-                return response["response"].strip()
-            elif "text" in response:
-                return response["text"].strip()
-        
-        return str(response).strip()
+        return _ollama_response_text(response)
     
     except ImportError:
         raise Exception(
@@ -110,6 +199,114 @@ def _generate_with_ollama(prompt: str, model: str = "llama3.2") -> str:
         raise Exception(f"Ollama error: {e}")
 
 
+async def _agenerate_with_ollama(prompt: str, model: str = "llama3.2") -> str:
+    """
+    Generate answer using Ollama's async client (local, free).
+    """
+    global _ollama_async_client
+    try:
+        import ollama
+        
+        if _ollama_async_client is None:
+            _ollama_async_client = ollama.AsyncClient()
+        
+        response = await _ollama_async_client.generate(
+            model=model,
+            prompt=prompt,
+            options={
+                "temperature": 0.7,
+                "num_predict": 500,
+                "num_ctx": 4096  # Fixed context size, so the loaded model (and its prompt cache) is reused
+            }
+        )
+        
+        return _ollama_response_text(response)
+    
+    except ImportError:
+        raise Exception(
+            "Ollama Python library not installed. Install with: pip install ollama\n"
+            "Also make sure Ollama is installed and running: https://ollama.ai/\n"
+            "Run 'ollama pull llama3.2' to download a model."
+        )
+    except Exception as e:
+        raise Exception(f"Ollama error: {e}")
+
+
+def _huggingface_request(prompt: str) -> dict:
+    """Build the JSON body for a Hugging Face text generation request."""
+    return {
+        "inputs": prompt,
+        "parameters": {
+            "max_new_tokens": 500,
+            "temperature": 0.7,
+            "return_full_text": False
+        }
+    }
+
+
+def _huggingface_response_text(response) -> str:
+    """
+    Extract the generated text from a Hugging Face API response.
+    
+    Works with both requests and httpx responses. A 503 (model loading)
+    is handled by the caller.
+    """
+    if response.status_code == 200:
+        result = response.json()
+        # Handle different response formats from router API
+        if isinstance(result, list) and len(result) > 0:
+            result = result[0]
+        
+        if isinstance(result, dict):
+            if "generated_text" in result:
+                return result["generated_text"].strip()
+            elif "text" in result:
+                return result["text"].strip()
+            elif "response" in result:
+                return result["response"].strip()
+            # Try to extract text from any nested structure
+            for key in ["text", "output", "content", "message"]:
+                if key in result:
+                    return str(result[key]).strip()
+        
+        # If we get a string directly, return it
+        if isinstance(result, str):
+            return result.strip()
+        
+        # Last resort: return string representation
+        return str(result).strip()
+    elif response.status_code == 401:
+        # Unauthorized - API key or auth required
+        raise ValueError(
+            "Hugging Face API authentication failed (401). "
+            "Some models require authentication. Please install Ollama for local use, "
+            "or check if this model requires an API key."
+        )
+    elif response.status_code == 429:
+        return _RATE_LIMITED_ANSWER
+    else:
+        # Try to parse error message, avoid showing raw HTML
+        error_msg = f"Error {response.status_code}"
+        try:
+            error_json = response.json()
+            if "error" in error_json:
+                error_msg = error_json["error"]
+        except:
+            # If response is HTML, don't show it - provide a clean error
+            if "text/html" in response.headers.get("content-type", "").lower():
+                error_msg = f"API returned HTML error page (status {response.status_code}). "
+                if response.status_code == 401:
+                    error_msg += "Authentication required. Try installing Ollama for local use."
+                else:
+                    error_msg += "The model may be unavailable or require authentication."
+            else:
+                # Try to extract readable text from response
+                text = response.text[:200]  # Limit length
+                if not text.startswith("<"):  # Not HTML
+                    error_msg = text
+        raise ValueError(f"Hugging Face API error: {error_msg}")
+
+
 def _generate_with_huggingface(prompt: str, model: str = "mistralai/Mistral-7B-Instruct-v0.2") -> str:
     """
     Generate answer using Hugging Face Inference API (free tier, no key required for some models).
@@ -119,79 +316,59 @@ def _generate_with_huggingface(prompt: str, model: str = "mistralai/Mistral-7B-I
         # Use the new router endpoint
         api_url = f"https://router.huggingface.co/models/{model}"
         
-        response = requests.post(
+        response = _hf_session.post(
             api_url,
             headers={"Content-Type": "application/json"},
-            json={
-                "inputs": prompt,
-                "parameters": {
-                    "max_new_tokens": 500,
-                    "temperature": 0.7,
-                    "return_full_text": False
-                }
-            },
+            json=_huggingface_request(prompt),
             timeout=30
         )
         
-        if response.status_code == 200:
-            result = response.json()
-            # Handle different response formats from router API
-            if isinstance(result, list) and len(result) > 0:
-                result = result[0]
-            
-            if isinstance(result, dict):
-                if "generated_text" in result:
-                    return result["generated_text"].strip()
-                elif "text" in result:
-                    return result["text"].strip()
-                elif "response" in result:
-                    return result["response"].strip()
-                # Try to extract text from any nested structure
-                for key in ["text", "output", "content", "message"]:
-                    if key in result:
-                        return str(result[key]).strip()
-            
-            # If we get a string directly, return it
-            if isinstance(result, str):
-                return result.strip()
-            
-            # Last resort: return string representation
-            return str(result).strip()
-        elif response.status_code == 503:
+        if response.status_code == 503:
             # Model is loading, wait a bit
             import time
             time.sleep(5)
-            return "The model is loading, please try again in a few seconds. Please wait and try again."
-        elif response.status_code == 401:
-            # Unauthorized - API key or auth required
-            raise ValueError(
-                "Hugging Face API authentication failed (401). "
-                "Some models require authentication. Please install Ollama for local use, "
-                "or check if this model requires an API key."
-            )
-        elif response.status_code == 429:
-            return "Rate limit exceeded. Please try again in a few moments."
-        else:
-            # Try to parse error message, avoid showing raw HTML
-            error_msg = f"Error {response.status_code}"
-            try:
-                error_json = response.json()
-                if "error" in error_json:
-                    error_msg = error_json["error"]
-            except:
-                # If response is HTML, don't show it - provide a clean error
-                if "text/html" in response.headers.get("content-type", "").lower():
-                    error_msg = f"API returned HTML error page (status {response.status_code}). "
-                    if response.status_code == 401:
-                        error_msg += "Authentication required. Try installing Ollama for local use."
-                    else:
-                        error_msg += "The model may be unavailable or require authentication."
-                else:
-                    # Try to extract readable text from response
-                    text = response.text[:200]  # Limit length
-                    if not text.startswith("<"):  # Not HTML
-                        error_msg = text
-            raise ValueError(f"Hugging Face API error: {error_msg}")
+            return _MODEL_LOADING_ANSWER
+        return _huggingface_response_text(response)
+    
+    except Exception as e:
+        raise ValueError(f"Error generating answer with Hugging Face: {str(e)}")
+
+
+def _get_hf_async_client() -> httpx.AsyncClient:
+    """Lazy load the async HTTP client used for Hugging Face requests."""
+    global _hf_async_client
+    if _hf_async_client is None:
+        try:
+            import h2  # noqa: F401 - HTTP/2 support is optional
+            http2 = True
+        except ImportError:
+            http2 = False
+        _hf_async_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(max_keepalive_connections=40),
+            timeout=30
+        )
+    return _hf_async_client
+
+
+async def _agenerate_with_huggingface(prompt: str, model: str = "mistralai/Mistral-7B-Instruct-v0.2") -> str:
+    """
+    Generate answer using the Hugging Face Inference API through the async client.
+    """
+    try:
+        api_url = f"https://router.huggingface.co/models/{model}"
+        
+        response = await _get_hf_async_client().post(
+            api_url,
+            headers={"Content-Type": "application/json"},
+            json=_huggingface_request(prompt)
+        )
+        
+        if response.status_code == 503:
+            # Model is loading, wait a bit
+            await asyncio.sleep(5)
+            return _MODEL_LOADING_ANSWER
+        return _huggingface_response_text(response)
     
     except Exception as e:
         raise ValueError(f"Error generating answer with Hugging Face: {str(e)}")
@@ -216,17 +393,5 @@ def generate_answer_simple(question: str, context_chunks: List[str]) -> str:
 
 
 def _create_prompt(question: str, context_chunks: List[str]) -> str:
-    """Helper to create prompt."""
-    context = "\n\n".join([f"[Document Excerpt {i+1}]:\n{chunk}" 
-                           for i, chunk in enumerate(context_chunks)])
-    return f"""You are a helpful AI assistant that answers questions based on the provided document context.
-Use only the information from the context to answer questions. If the context doesn't contain 
-enough information to answer the question, say so clearly. Be concise and accurate.
-
-Context from documents:
-{context}
-
-Question: {question}
-
-Please provide an answer based on the context above."""
-
+    """Helper to create prompt (static instructions first, then context and question)."""
+    return f"{SYSTEM_PROMPT}\n\n{build_prompt(question, context_chunks, stable_order=True)}"
@@ -3,15 +3,27 @@ Utility module for extracting text from PDF files.
 """
 import PyPDF2
 from io import BytesIO
-from typing import Optional
+from typing import BinaryIO, Optional, Union
+import os
 
+# pypdfium2 (Google's PDFium, a C++ library) is much faster than pure-Python
+# PyPDF2 and extracts cleaner text; PyPDF2 remains as the fallback
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
 
-def extract_text_from_pdf(file_content: bytes) -> str:
+
+def extract_text_from_pdf(file_content: Union[bytes, str, os.PathLike, BinaryIO]) -> str:
     """
     Extract text content from a PDF file.
     
+    Pages are read from the source on demand, so passing a path or an open
+    file avoids holding the whole PDF in memory.
+    
     Args:
-        file_content: Binary content of the PDF file
+        file_content: Binary content of the PDF file, a path to it, or a
+            seekable binary file object
         
     Returns:
         Extracted text as a string
@@ -20,24 +32,76 @@ def extract_text_from_pdf(file_content: bytes) -> str:
         ValueError: If the PDF cannot be read or is empty
     """
     try:
-        pdf_file = BytesIO(file_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        if len(pdf_reader.pages) == 0:
+        if isinstance(file_content, (bytes, bytearray)):
+            file_content = BytesIO(file_content)
+        if isinstance(file_content, (str, os.PathLike)):
+            # Open the file ourselves: given a path, PdfReader reads it all into memory
+            with open(file_content, "rb") as pdf_file:
+                return _extract_text(pdf_file)
+        return _extract_text(file_content)
+    
+    except Exception as e:
+        raise ValueError(f"Error reading PDF: {str(e)}")
+
+
+def _extract_text(pdf_file: BinaryIO) -> str:
+    """Extract text from an open PDF stream, preferring PDFium over PyPDF2."""
+    if pdfium is not None:
+        start = pdf_file.tell()
+        try:
+            return _extract_text_pdfium(pdf_file)
+        except ValueError:
+            raise  # Readable PDF, but empty or without text
+        except Exception as e:
+            print(f"Warning: PDFium could not read PDF ({e}), falling back to PyPDF2")
+            pdf_file.seek(start)
+    return _extract_text_pypdf2(pdf_file)
+
+
+def _extract_text_pdfium(pdf_file: BinaryIO) -> str:
+    """Extract text from an open PDF stream with pypdfium2."""
+    pdf = pdfium.PdfDocument(pdf_file)
+    try:
+        if len(pdf) == 0:
             raise ValueError("PDF file is empty - no pages found")
         
-        text = ""
-        for page_num, page in enumerate(pdf_reader.pages, 1):
-            page_text = page.extract_text()
+        parts = []
+        for page_num in range(1, len(pdf) + 1):
+            page = pdf[page_num - 1]
+            textpage = page.get_textpage()
+            page_text = textpage.get_text_range().replace("\r\n", "\n")
+            # Release each page right away to keep memory flat on large PDFs
+            textpage.close()
+            page.close()
             if page_text.strip():
-                text += f"\n--- Page {page_num} ---\n"
-                text += page_text
-        
-        if not text.strip():
-            raise ValueError("PDF file contains no extractable text")
-            
-        return text.strip()
+                parts.append(f"\n--- Page {page_num} ---\n")
+                parts.append(page_text)
+    finally:
+        pdf.close()
     
-    except Exception as e:
-        raise ValueError(f"Error reading PDF: {str(e)}")
+    text = "".join(parts)
+    if not text.strip():
+        raise ValueError("PDF file contains no extractable text")
+    
+    return text.strip()
 
+
+def _extract_text_pypdf2(pdf_file: BinaryIO) -> str:
+    """Extract text from an open PDF stream with PyPDF2."""
+    pdf_reader = PyPDF2.PdfReader(pdf_file)
+    
+    if len(pdf_reader.pages) == 0:
+        raise ValueError("PDF file is empty - no pages found")
+    
+    parts = []
+    for page_num, page in enumerate(pdf_reader.pages, 1):
+        page_text = page.extract_text()
+        if page_text and page_text.strip():
+            parts.append(f"\n--- Page {page_num} ---\n")
+            parts.append(page_text)
+    
+    text = "".join(parts)
+    if not text.strip():
+        raise ValueError("PDF file contains no extractable text")
+        
+    return text.strip()
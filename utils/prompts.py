@@ -0,0 +1,40 @@
+"""
+Utility module for building the RAG prompts shared by the LLM clients.
+"""
+import hashlib
+from typing import List
+
+
+# Static instructions, sent first so LLM servers can reuse their cached
+# prompt prefix across requests
+SYSTEM_PROMPT = """You are a helpful AI assistant that answers questions based on the provided document context.
+Use only the information from the context to answer questions. If the context doesn't contain
+enough information to answer the question, say so clearly. Be concise and accurate."""
+
+
+def build_prompt(question: str, context_chunks: List[str], stable_order: bool = False) -> str:
+    """
+    Build the user prompt for a question from the retrieved document chunks.
+    
+    Args:
+        question: The user's question
+        context_chunks: List of relevant document chunks retrieved from vector DB
+            (most relevant first)
+        stable_order: Order the chunks by content hash instead of score, so
+            the same retrieved chunks always produce the same prompt prefix
+            (for servers that cache prompt prefixes, e.g. Ollama)
+        
+    Returns:
+        The prompt text (context followed by the question)
+    """
+    ordered_chunks = context_chunks
+    if stable_order:
+        ordered_chunks = sorted(context_chunks, key=lambda chunk: hashlib.sha1(chunk.encode("utf-8")).digest())
+    context = "\n\n".join(f"[Document Excerpt {i+1}]:\n{chunk}"
+                          for i, chunk in enumerate(ordered_chunks))
+    return f"""Context from documents:
+{context}
+
+Question: {question}
+
+Please provide an answer based on the context above."""
@@ -0,0 +1,138 @@
+"""
+Utility module for caching answers to semantically similar questions.
+"""
+import numpy as np
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+
+class SemanticCache:
+    """
+    Caches (answer, sources) by question embedding.
+    
+    Candidates are found with random-projection LSH: each of n_tables tables
+    hashes the sign pattern of n_bits projections, so similar questions land
+    in the same bucket in at least one table. A hit is only returned after
+    checking the actual cosine similarity against the threshold.
+    """
+    
+    def __init__(self, dimension: int = 1536, n_tables: int = 8, n_bits: int = 12,
+                 threshold: float = 0.95, max_entries: int = 1000, seed: int = 0):
+        """
+        Initialize the cache.
+        
+        Args:
+            dimension: Dimension of question embeddings
+            n_tables: Number of LSH hash tables
+            n_bits: Number of random projections (signature bits) per table
+            threshold: Minimum cosine similarity for a cache hit
+            max_entries: Maximum number of cached answers (oldest are evicted)
+            seed: Seed for the random projections
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        rng = np.random.default_rng(seed)
+        # All tables' projections stacked into one (n_tables * n_bits, dimension) matrix
+        self._planes = rng.standard_normal((n_tables * n_bits, dimension)).astype(np.float32)
+        self._n_tables = n_tables
+        self._n_bits = n_bits
+        self._powers = 1 << np.arange(n_bits, dtype=np.int64)
+        
+        self._entries = OrderedDict()  # id -> (embedding, signatures, answer, sources)
+        self._tables = [{} for _ in range(n_tables)]  # signature -> set of ids
+        self._next_id = 0
+        self._generation = 0  # Bumped by clear()
+        self._lock = threading.Lock()
+    
+    def _normalize(self, embedding) -> np.ndarray:
+        """Return embedding as a unit-length float32 vector."""
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    def _signatures(self, vector: np.ndarray) -> Tuple[int, ...]:
+        """Compute one n_bits-bit signature per table."""
+        bits = (self._planes @ vector > 0).reshape(self._n_tables, self._n_bits)
+        return tuple(int(s) for s in bits @ self._powers)
+    
+    def get(self, embedding) -> Optional[Tuple[str, List[str]]]:
+        """
+        Look up a cached answer for a similar question.
+        
+        Args:
+            embedding: Question embedding
+        
+        Returns:
+            (answer, sources) of the most similar cached question, or None
+        """
+        vector = self._normalize(embedding)
+        signatures = self._signatures(vector)
+        
+        with self._lock:
+            candidates = set()
+            for table, signature in zip(self._tables, signatures):
+                candidates.update(table.get(signature, ()))
+            
+            best_id, best_score = None, self.threshold
+            for entry_id in candidates:
+                score = float(np.dot(self._entries[entry_id][0], vector))
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+            
+            if best_id is None:
+                return None
+            _, _, answer, sources = self._entries[best_id]
+            return answer, list(sources)
+    
+    @property
+    def generation(self) -> int:
+        """Number of times the cache was cleared; pass to put() to detect a clear."""
+        return self._generation
+    
+    def put(self, embedding, answer: str, sources: List[str], generation: Optional[int] = None):
+        """
+        Cache the answer to a question.
+        
+        Args:
+            embedding: Question embedding
+            answer: Generated answer
+            sources: Document excerpts used for the answer
+            generation: The cache's generation from before the sources were
+                retrieved; if the cache was cleared since (the documents
+                changed), the answer is stale and not cached
+        """
+        vector = self._normalize(embedding)
+        signatures = self._signatures(vector)
+        
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (vector, signatures, answer, list(sources))
+            for table, signature in zip(self._tables, signatures):
+                table.setdefault(signature, set()).add(entry_id)
+            
+            while len(self._entries) > self.max_entries:
+                self._evict_oldest()
+    
+    def _evict_oldest(self):
+        """Remove the oldest entry from the cache and its buckets."""
+        entry_id, (_, signatures, _, _) = self._entries.popitem(last=False)
+        for table, signature in zip(self._tables, signatures):
+            bucket = table[signature]
+            bucket.discard(entry_id)
+            if not bucket:
+                del table[signature]
+    
+    def clear(self):
+        """Remove all cached answers (e.g. after the documents change)."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            for table in self._tables:
+                table.clear()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
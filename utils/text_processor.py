@@ -4,6 +4,10 @@ Utility module for processing and chunking text documents.
 from typing import List
 
 
+# Characters treated as sentence endings when choosing chunk boundaries
+SENTENCE_ENDINGS = ('.', '!', '?', '\n')
+
+
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
     """
     Split text into overlapping chunks for better context retention.
@@ -30,12 +34,12 @@ def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[st
         
         # Try to break at sentence boundaries for better chunking
         if end < len(text):
-            # Look for sentence endings near the chunk boundary
-            sentence_endings = ['.', '!', '?', '\n']
-            for i in range(end, max(start, end - 200), -1):
-                if text[i] in sentence_endings:
-                    end = i + 1
-                    break
+            # Look for the last sentence ending near the chunk boundary
+            # (str.rfind scans in C rather than one Python step per character)
+            boundary = max(text.rfind(ending, max(start, end - 200) + 1, end + 1)
+                           for ending in SENTENCE_ENDINGS)
+            if boundary != -1:
+                end = boundary + 1
         
         # Extract chunk
         chunk = text[start:end].strip()
@@ -1,149 +1,864 @@
 """
 Utility module for managing FAISS vector database.
 """
+import os
+
+# Let idle OpenMP threads sleep instead of spinning between FAISS calls, where
+# they would compete with the embedding model and BLAS threads. Must be set
+# before the OpenMP runtime is loaded (with faiss).
+os.environ.setdefault("OMP_WAIT_POLICY", "PASSIVE")
+
 import faiss
 import numpy as np
+import asyncio
+import itertools
+import json
 import pickle
-import os
-from typing import List, Tuple
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
 from pathlib import Path
 
 
+# An "hnsw" database keeps an exact flat index until it holds this many
+# vectors; below that, brute force is as fast and needs no graph
+HNSW_MIN_VECTORS = 1000
+
+# An "ivfpq" database keeps an exact flat index until it holds this many
+# vectors, then trains the IVF-PQ quantizers on them
+IVFPQ_MIN_TRAINING_VECTORS = 10000
+
+# An "sq8" database keeps an exact flat index until it holds this many
+# vectors, then trains the per-dimension int8 ranges on them
+SQ8_MIN_TRAINING_VECTORS = 1000
+
+# Saves append new vectors to a write-ahead log instead of rewriting the
+# index and embeddings files, until the log holds this many vectors
+WAL_MAX_VECTORS = 10000
+
+# A read-only database retries loading this many times when the files change
+# under it (a writer in another process saving at the same time)
+READ_ONLY_LOAD_ATTEMPTS = 5
+
+
 class VectorDB:
     """
     A simple wrapper around FAISS for storing and searching document embeddings.
     """
     
-    def __init__(self, dimension: int = 1536, index_path: str = "data/faiss_index.pkl"):
+    def __init__(self, dimension: int = 1536, index_path: str = "data/faiss_index.pkl",
+                 index_type: str = "flat", read_only: bool = False, use_gpu: bool = False):
         """
         Initialize the vector database.
         
         Args:
             dimension: Dimension of embeddings (1536 for text-embedding-3-small)
             index_path: Path to save/load the FAISS index
+            index_type: "flat" for exact brute-force search, "hnsw" for
+                approximate graph search (sub-linear, for large collections;
+                used from HNSW_MIN_VECTORS vectors on), "sq8" for brute-force
+                search over int8-quantized vectors (4x less memory), or
+                "ivfpq" for product-quantized storage (~48 bytes per vector,
+                for very large collections)
+            read_only: Only allow searching. The saved index and embeddings
+                are memory-mapped instead of copied to the heap, so processes
+                serving the same database share one copy in the OS page cache.
+                (Writable databases map them too, but copy the index into
+                memory on the first change.)
+            use_gpu: Keep flat indexes on the first GPU when faiss-gpu is
+                installed (ignored otherwise, and in read-only mode)
         """
+        if index_type not in ("flat", "hnsw", "sq8", "ivfpq"):
+            raise ValueError(f"Unsupported index type: {index_type}")
+        
         self.dimension = dimension
         self.index_path = index_path
-        self.index = faiss.IndexFlatL2(dimension)  # L2 distance for similarity
+        # Sidecar files share the index path's name, minus ".pkl" (other names
+        # get the suffixes appended, so no sidecar can overwrite index_path)
+        base_path = index_path[:-len('.pkl')] if index_path.endswith('.pkl') else index_path
+        self._index_file = base_path + '.index'
+        self._emb_file = base_path + '.emb.npy'
+        self._chunks_file = base_path + '.jsonl'
+        self._wal_file = base_path + '.wal'
+        self.index_type = index_type
+        self.read_only = read_only
+        self.use_gpu = (use_gpu and not read_only
+                        and hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0)
+        self._gpu_resources = faiss.StandardGpuResources() if self.use_gpu else None
+        # Inner product over L2-normalized vectors = cosine similarity
+        self.index = self._new_index()
         self.texts = []  # Store original text chunks
-        self.metadata = []  # Store metadata (filename, chunk_index, etc.)
-        self.embeddings = []  # Store embeddings for deletion purposes
+        # Per-chunk metadata stored column-wise: the (interned) filename plus
+        # chunk position arrays, instead of one dict per chunk
+        self.filenames: List[Optional[str]] = []
+        self.chunk_indices = np.empty(0, dtype=np.int32)
+        self.total_chunks = np.empty(0, dtype=np.int32)
+        # Per-file summary (filename -> {"filename", "chunks", "first_chunk_index"}),
+        # kept up to date so listing files doesn't scan every chunk
+        self._file_info: Dict[str, dict] = {}
+        # Embeddings as one contiguous (N, dimension) float32 matrix, kept for deletion
+        self.embeddings = np.empty((0, dimension), dtype=np.float32)
+        
+        # Changes are persisted lazily by flush()/autosave() rather than on every write
+        self._dirty = False
+        # Number of chunks already written to the .jsonl file; None means it
+        # must be rewritten (after deletions, or for older database files)
+        self._saved_chunks: Optional[int] = None
+        # Number of vectors in the saved .index/.emb.npy files that the
+        # write-ahead log extends; None means they must be rewritten
+        self._saved_vectors: Optional[int] = None
+        # Bumped whenever the saved files must be rewritten, so a save running
+        # concurrently doesn't mark its (older) snapshot as saved
+        self._generation = 0
+        # The index as memory-mapped by load(), until the first change copies it
+        self._mapped_index = None
+        self._lock = threading.RLock()
+        # Serializes saves; taken before _lock, and never by searches or adds
+        self._save_lock = threading.RLock()
         
         # Load existing index if it exists
         self.load()
     
-    def add_documents(self, embeddings: List[List[float]], texts: List[str], 
-                     metadata: List[dict] = None):
+    @property
+    def embeddings(self) -> np.ndarray:
+        """The stored embeddings, an (N, dimension) view of the growable buffer."""
+        return self._emb_buffer[:self._emb_count]
+    
+    @embeddings.setter
+    def embeddings(self, value: np.ndarray):
+        self._emb_buffer = value
+        self._emb_count = len(value)
+    
+    def _append_embeddings(self, vectors: np.ndarray) -> np.ndarray:
         """
-        Add document embeddings to the vector database.
+        Append rows to the embedding matrix, growing its capacity geometrically.
+        
+        Returns:
+            The appended rows, as a view into the matrix
+        """
+        needed = self._emb_count + len(vectors)
+        if needed > len(self._emb_buffer):
+            # Double the capacity so appends cost amortized O(rows added)
+            self._resize_embeddings(max(needed, 2 * len(self._emb_buffer)))
+        self._emb_buffer[self._emb_count:needed] = vectors
+        rows = self._emb_buffer[self._emb_count:needed]
+        self._emb_count = needed
+        return rows
+    
+    def _resize_embeddings(self, capacity: int):
+        """Move the embedding matrix to a new buffer with room for capacity rows."""
+        buffer = np.empty((capacity, self.dimension), dtype=np.float32)
+        buffer[:self._emb_count] = self.embeddings
+        self._emb_buffer = buffer
+    
+    def reserve(self, n: int):
+        """
+        Preallocate room for n chunks in total.
+        
+        Call before adding many documents of known total size (e.g. a bulk
+        import), so the embedding matrix is allocated once instead of being
+        regrown and copied along the way.
         
         Args:
-            embeddings: List of embedding vectors
-            texts: List of corresponding text chunks
-            metadata: Optional list of metadata dictionaries
+            n: Expected total number of chunks in the database
         """
-        if not embeddings or not texts:
+        self._check_writable()
+        with self._lock:
+            if n > len(self._emb_buffer) and len(self.embeddings) == len(self.texts):
+                self._resize_embeddings(n)
+    
+    def _promote_index(self):
+        """Copy a memory-mapped index into memory before it is changed."""
+        if self._mapped_index is not None:
+            if self.index is self._mapped_index:
+                self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self._mapped_index = None
+    
+    def _check_writable(self):
+        """Raise if the database was opened read-only."""
+        if self.read_only:
+            raise ValueError("Vector database is opened read-only")
+    
+    def _new_index(self, vectors: Optional[np.ndarray] = None):
+        """
+        Create an empty FAISS index for this database.
+        
+        Args:
+            vectors: The vectors the index will hold; small databases get a
+                flat index, and SQ8 and IVF-PQ indexes are trained on them
+        """
+        count = 0 if vectors is None else len(vectors)
+        if self.index_type == "hnsw" and count >= HNSW_MIN_VECTORS:
+            index = faiss.IndexHNSWFlat(self.dimension, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = 200
+            index.hnsw.efSearch = 64
+            return index
+        if self.index_type == "sq8" and count >= SQ8_MIN_TRAINING_VECTORS:
+            index = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_8bit,
+                                               faiss.METRIC_INNER_PRODUCT)
+            index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+            return index
+        if self.index_type == "ivfpq" and count >= IVFPQ_MIN_TRAINING_VECTORS:
+            return self._train_ivfpq_index(vectors)
+        return self._to_device(faiss.IndexFlatIP(self.dimension))
+    
+    def _to_device(self, index):
+        """Move a flat index to the GPU if enabled (other index types stay on the CPU)."""
+        if self.use_gpu and isinstance(index, faiss.IndexFlat):
+            return faiss.index_cpu_to_gpu(self._gpu_resources, 0, index)
+        return index
+    
+    def _cpu_index(self):
+        """Return the index in CPU memory, e.g. for writing it to disk."""
+        if self.use_gpu and isinstance(self.index, faiss.GpuIndex):
+            return faiss.index_gpu_to_cpu(self.index)
+        return self.index
+    
+    def _legacy_l2_index(self) -> bool:
+        """
+        Whether the index is an L2 index from before the switch to cosine
+        similarity that couldn't be migrated (no stored embeddings). Its
+        vectors are raw, so queries and new vectors are not normalized.
+        """
+        return self.index.metric_type == faiss.METRIC_L2
+    
+    def _outgrew_flat_index(self) -> bool:
+        """Whether the database still uses a flat index but is now big enough for its index type."""
+        if isinstance(self.index, (faiss.IndexHNSW, faiss.IndexScalarQuantizer, faiss.IndexIVF)):
+            return False
+        if self.index_type == "hnsw":
+            return len(self.embeddings) >= HNSW_MIN_VECTORS
+        if self.index_type == "sq8":
+            return len(self.embeddings) >= SQ8_MIN_TRAINING_VECTORS
+        if self.index_type == "ivfpq":
+            return len(self.embeddings) >= IVFPQ_MIN_TRAINING_VECTORS
+        return False
+    
+    def _train_ivfpq_index(self, vectors: np.ndarray):
+        """Create an IVF-PQ index with 8-bit codes, trained on vectors."""
+        # Up to 48 sub-quantizers; the count must divide the dimension
+        m = next(m for m in range(min(48, self.dimension), 0, -1) if self.dimension % m == 0)
+        nlist = min(1024, int(4 * np.sqrt(len(vectors))))
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        index = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+        index.train(np.ascontiguousarray(vectors, dtype=np.float32))
+        index.nprobe = 16
+        return index
+    
+    def add_documents(self, embeddings: Union[np.ndarray, List[List[float]]], texts: List[str], 
+                     filename: Optional[str] = None, total_chunks: Optional[int] = None):
+        """
+        Add the chunks of one document to the vector database.
+        
+        Args:
+            embeddings: (N, dimension) array or list of embedding vectors
+            texts: List of corresponding text chunks, in document order
+            filename: Name of the document the chunks come from
+            total_chunks: Number of chunks in the document (defaults to len(texts))
+        """
+        if len(embeddings) == 0 or not texts:
             return
         
         if len(embeddings) != len(texts):
             raise ValueError("Number of embeddings must match number of texts")
         
-        # Convert to numpy array
-        embeddings_array = np.array(embeddings).astype('float32')
+        self._check_writable()
         
-        # Add to FAISS index
-        self.index.add(embeddings_array)
+        # No copy yet for a float32 ndarray (the fast path); lists are converted once
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(texts), self.dimension)
         
-        # Store texts, metadata, and embeddings
-        self.texts.extend(texts)
-        self.embeddings.extend(embeddings)  # Store embeddings for deletion
-        if metadata:
-            self.metadata.extend(metadata)
-        else:
-            # Create default metadata
-            self.metadata.extend([{}] * len(texts))
-        
-        # Save after adding
-        self.save()
+        with self._lock:
+            # Store embeddings for deletion (unless this is an old database
+            # whose earlier embeddings were never stored). They are copied
+            # straight into the embedding matrix and normalized there, so
+            # the caller's array is never modified.
+            has_embeddings = len(self.embeddings) == len(self.texts)
+            if has_embeddings:
+                embeddings_array = self._append_embeddings(vectors)
+            else:
+                embeddings_array = vectors.copy()
+            if not self._legacy_l2_index():
+                faiss.normalize_L2(embeddings_array)
+            
+            # Add to FAISS index
+            self._promote_index()
+            self.index.add(embeddings_array)
+            
+            # Enough vectors to switch from flat to an HNSW or IVF-PQ index
+            if has_embeddings and self._outgrew_flat_index():
+                self.index = self._new_index(self.embeddings)
+                self.index.add(self.embeddings)
+                self._saved_vectors = None
+                self._generation += 1
+            
+            # Store texts and metadata
+            self.texts.extend(texts)
+            if filename is not None:
+                filename = sys.intern(filename)
+            if total_chunks is None:
+                total_chunks = len(texts)
+            self.filenames.extend([filename] * len(texts))
+            self.chunk_indices = np.concatenate([self.chunk_indices, np.arange(len(texts), dtype=np.int32)])
+            self.total_chunks = np.concatenate([self.total_chunks, np.full(len(texts), total_chunks, dtype=np.int32)])
+            if filename:
+                if filename in self._file_info:
+                    self._file_info[filename]["chunks"] += len(texts)
+                else:
+                    self._file_info[filename] = {"filename": filename, "chunks": len(texts), "first_chunk_index": 0}
+            
+            # Persisted later by flush()
+            self._dirty = True
     
-    def search(self, query_embedding: List[float], k: int = 3) -> List[Tuple[str, float, dict]]:
+    def _get_metadata(self, idx: int) -> dict:
+        """Build the metadata dictionary for the chunk at position idx."""
+        if idx >= len(self.filenames) or self.filenames[idx] is None:
+            return {}
+        return {
+            "filename": self.filenames[idx],
+            "chunk_index": int(self.chunk_indices[idx]),
+            "total_chunks": int(self.total_chunks[idx])
+        }
+    
+    def search(self, query_embedding: Union[np.ndarray, List[float]], k: int = 3) -> List[Tuple[str, float, dict]]:
         """
         Search for similar documents in the vector database.
         
         Args:
-            query_embedding: The query embedding vector
+            query_embedding: The query embedding vector (ideally a float32 ndarray)
             k: Number of results to return
             
         Returns:
-            List of tuples: (text, distance, metadata)
+            List of tuples: (text, score, metadata), where score is the cosine
+            similarity (higher is more similar)
         """
-        if self.index.ntotal == 0:
-            return []
+        return self.search_batch([query_embedding], k)[0]
+    
+    def search_batch(self, query_embeddings: Union[np.ndarray, List[List[float]]],
+                     k: int = 3) -> List[List[Tuple[str, float, dict]]]:
+        """
+        Search for similar documents for several queries at once.
         
-        # Convert query to numpy array
-        query_array = np.array([query_embedding]).astype('float32')
+        Prefer this over calling search() in a loop: FAISS answers the whole
+        batch with one matrix multiplication and parallelizes across queries,
+        while a single query runs on one thread.
         
-        # Search in FAISS
-        distances, indices = self.index.search(query_array, min(k, self.index.ntotal))
+        Args:
+            query_embeddings: (B, dimension) array or list of query embedding vectors
+            k: Number of results to return per query
+            
+        Returns:
+            One list of (text, score, metadata) tuples per query, as in search()
+        """
+        scores, _, texts, metadata = self.search_arrays(query_embeddings, k)
+        return [list(zip(row_texts, row_scores.tolist(), row_metadata))
+                for row_scores, row_texts, row_metadata in zip(scores, texts, metadata)]
+    
+    def search_arrays(self, query_embeddings: Union[np.ndarray, List[List[float]]],
+                      k: int = 3) -> Tuple[np.ndarray, np.ndarray, List[List[str]], List[List[dict]]]:
+        """
+        Search like search_batch(), but return the FAISS result arrays as is.
+        
+        For callers that rescore or rerank the results with numpy, instead of
+        unpacking one tuple per result.
+        
+        Args:
+            query_embeddings: (B, dimension) array or list of query embedding vectors
+            k: Number of results to return per query
+            
+        Returns:
+            (scores, indices, texts, metadata): (B, min(k, size)) float32 cosine
+            similarities and int64 chunk positions (-1 past the last result if an
+            approximate index found fewer), plus per query the texts and
+            metadata of its valid results, in the same order
+        """
+        # Convert queries to float32 rows (a copy, so the caller's
+        # embeddings are not normalized in place)
+        query_array = np.array(query_embeddings, dtype=np.float32).reshape(-1, self.dimension)
         
-        # Return results with text and metadata
-        results = []
-        for i, idx in enumerate(indices[0]):
-            if idx >= 0:  # Valid index
-                distance = float(distances[0][i])
-                text = self.texts[idx]
-                metadata = self.metadata[idx] if idx < len(self.metadata) else {}
-                results.append((text, distance, metadata))
+        # Search and look up the results under the lock: a concurrent add or
+        # delete (e.g. in a request thread) changes the index and texts in place
+        with self._lock:
+            if self.index.ntotal == 0:
+                count = len(query_array)
+                return (np.empty((count, 0), dtype=np.float32), np.empty((count, 0), dtype=np.int64),
+                        [[] for _ in range(count)], [[] for _ in range(count)])
+            
+            legacy_l2 = self._legacy_l2_index()
+            if not legacy_l2:
+                faiss.normalize_L2(query_array)
+            
+            # Search in FAISS. FAISS parallelizes over queries, so a single query
+            # runs on one thread; skip OpenMP's thread fork/join for it. (The
+            # thread count is per calling thread, so concurrent adds keep theirs.)
+            threads = faiss.omp_get_max_threads()
+            if len(query_array) == 1:
+                faiss.omp_set_num_threads(1)
+            try:
+                scores, indices = self.index.search(query_array, min(k, self.index.ntotal))
+            finally:
+                faiss.omp_set_num_threads(threads)
+            if legacy_l2:
+                # Squared L2 distances of raw vectors: turn them into scores
+                # where higher is better (the cosine similarity for unit vectors)
+                scores = 1 - scores / 2
+            
+            # Look up texts and metadata of the valid results
+            texts = []
+            metadata = []
+            for row_indices in indices.tolist():
+                valid = [idx for idx in row_indices if idx >= 0]
+                texts.append([self.texts[idx] for idx in valid])
+                metadata.append([self._get_metadata(idx) for idx in valid])
         
-        return results
+        return scores, indices, texts, metadata
     
     def save(self):
-        """Save the FAISS index and associated data to disk."""
-        # Create directory if it doesn't exist
-        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        """
+        Save the FAISS index and associated data to disk.
         
-        # Save index
-        faiss.write_index(self.index, self.index_path.replace('.pkl', '.index'))
+        Only the snapshot of the data to write is taken under the lock; the
+        files are written and synced outside it, so adds and searches don't
+        wait on the disk.
+        """
+        self._check_writable()
+        with self._save_lock:
+            with self._lock:
+                # Create directory if it doesn't exist
+                os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+                
+                count = len(self.texts)
+                appended_from = self._saved_chunks if os.path.exists(self._chunks_file) else None
+                append_to_wal = self._can_append_to_wal(appended_from)
+                start = appended_from or 0
+                chunks = (self.texts[start:count], self.filenames[start:count],
+                          self.chunk_indices[start:count].tolist(), self.total_chunks[start:count].tolist())
+                # Stored rows are never modified in place (appends go past
+                # the end, deletes copy), so a view is a stable snapshot
+                embeddings = self.embeddings[start:count] if append_to_wal else self.embeddings
+                saved_vectors = self._saved_vectors
+                consistent = len(self.embeddings) == count == self.index.ntotal
+                if not append_to_wal:
+                    # Adds change the index in place: write it (to the page
+                    # cache) before releasing the lock
+                    faiss.write_index(self._cpu_index(), self._index_file + '.tmp')
+                generation = self._generation
+                self._dirty = False
+            
+            try:
+                self._write_files(appended_from, append_to_wal, chunks, embeddings, saved_vectors)
+            except Exception:
+                with self._lock:
+                    self._dirty = True
+                    self._saved_chunks = None  # The .jsonl may end in a partial append
+                raise
+            
+            with self._lock:
+                if self._generation == generation:
+                    self._saved_chunks = count
+                    if not append_to_wal:
+                        self._saved_vectors = count if consistent else None
+    
+    def _write_files(self, appended_from: Optional[int], append_to_wal: bool,
+                     chunks: Tuple[list, list, list, list], embeddings: np.ndarray,
+                     saved_vectors: Optional[int]):
+        """
+        Write a snapshot taken by save() to the database files.
+        
+        Args:
+            appended_from: Number of chunks already in the .jsonl file, or
+                None to rewrite it
+            append_to_wal: Whether to append the new vectors to the
+                write-ahead log instead of rewriting the index files
+            chunks: Texts, filenames, chunk indices and total chunks to write
+            embeddings: The new vectors (appending to the log) or all of them
+            saved_vectors: Vector count of the saved index the log extends
+        """
+        records = (self._chunk_record(*chunk) for chunk in zip(*chunks))
+        
+        # Texts and metadata are saved one JSON line per chunk. New chunks are
+        # appended before their vectors: an interrupted append leaves extra
+        # texts, which load() trims.
+        if appended_from is not None:
+            with open(self._chunks_file, 'a', encoding='utf-8') as f:
+                f.writelines(records)
+        
+        if append_to_wal:
+            # Only append the new vectors to the write-ahead log
+            with open(self._wal_file, 'ab') as f:
+                if f.tell() == 0:
+                    # Header: the vector count of the saved index this log extends
+                    f.write(np.int64(saved_vectors).tobytes())
+                f.write(embeddings.tobytes())
+        else:
+            # Rewrite the files. All of them are written to temporary files
+            # first and committed together by the header: a save interrupted
+            # before the commit leaves the old files, one interrupted after
+            # it is finished by load(). Texts and vectors (e.g. after a
+            # delete) can thus never come from different saves.
+            replaced = [self._emb_file, self._index_file]
+            if appended_from is None:
+                with open(self._chunks_file + '.tmp', 'w', encoding='utf-8') as f:
+                    f.writelines(records)
+                replaced.append(self._chunks_file)
+            
+            # Save embeddings as a raw .npy file (a single memcpy, no pickling)
+            with open(self._emb_file + '.tmp', 'wb') as f:
+                np.save(f, embeddings)
+            
+            for path in replaced:
+                self._sync_file(path + '.tmp')
+            self._sync_directory()
+            self._write_header(replaced)
+            self._replace_files(replaced)
+            self._write_header()
         
-        # Save texts, metadata, and embeddings
+        self._sync_directory()
+    
+    def _sync_directory(self):
+        """Flush the directory entries (renames, new files) of the database to disk."""
+        if not hasattr(os, 'O_DIRECTORY'):
+            return  # Not supported on Windows
+        fd = os.open(os.path.dirname(self.index_path) or '.', os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def _sync_file(self, path: str):
+        """Flush the contents of a file to disk."""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def _write_header(self, replaced: Optional[List[str]] = None):
+        """
+        Atomically write the header (.pkl) file.
+        
+        Args:
+            replaced: Files whose temporary versions are committed by this
+                header and must replace them (None once they have)
+        """
         data = {
-            'texts': self.texts,
-            'metadata': self.metadata,
-            'embeddings': self.embeddings,
             'dimension': self.dimension
         }
-        with open(self.index_path, 'wb') as f:
-            pickle.dump(data, f)
+        if replaced:
+            data['replacing'] = [os.path.basename(path) for path in replaced]
+        with open(self.index_path + '.tmp', 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.index_path + '.tmp', self.index_path)
+        self._sync_directory()
+    
+    def _replace_files(self, replaced: List[str]):
+        """Move committed temporary files over the files they replace."""
+        # The logged vectors are in the new index and embeddings
+        if os.path.exists(self._wal_file):
+            os.remove(self._wal_file)
+        for path in replaced:
+            if os.path.exists(path + '.tmp'):
+                os.replace(path + '.tmp', path)
+    
+    def _can_append_to_wal(self, appended_from: Optional[int]) -> bool:
+        """Whether a save can append to the write-ahead log instead of rewriting the index."""
+        if appended_from is None or self._saved_vectors is None:
+            return False
+        if len(self.texts) - self._saved_vectors > WAL_MAX_VECTORS:
+            return False
+        # The log must hold exactly the vectors saved since the index was
+        # written (not e.g. a torn vector from an interrupted append)
+        logged = appended_from - self._saved_vectors
+        wal_size = os.path.getsize(self._wal_file) if os.path.exists(self._wal_file) else 0
+        return wal_size == 8 + logged * 4 * self.dimension or (logged == 0 and wal_size == 0)
+    
+    def _read_wal(self) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        Read the write-ahead log.
+        
+        Returns:
+            (vector count of the saved index it extends, logged vectors), or
+            None if there is no log
+        """
+        try:
+            with open(self._wal_file, 'rb') as f:
+                buffer = bytearray(f.read())
+        except FileNotFoundError:
+            return None
+        if len(buffer) < 8:
+            return None
+        base = int(np.frombuffer(buffer, dtype=np.int64, count=1)[0])
+        # Ignore a partial last vector from an interrupted append
+        count = (len(buffer) - 8) // (4 * self.dimension)
+        vectors = np.frombuffer(buffer, dtype=np.float32, count=count * self.dimension, offset=8)
+        return base, vectors.reshape(count, self.dimension)
+    
+    @staticmethod
+    def _chunk_record(text: str, filename: Optional[str], chunk_index: int, total_chunks: int) -> str:
+        """Serialize the text and metadata of one chunk as a JSON line."""
+        return json.dumps({
+            "text": text,
+            "filename": filename,
+            "chunk_index": chunk_index,
+            "total_chunks": total_chunks
+        }, ensure_ascii=False) + "\n"
+    
+    def _load_chunks(self, path: str):
+        """Read texts and metadata from the .jsonl file at path."""
+        texts = []
+        metadata = []
+        complete = True
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Partial last line from an interrupted append
+                    complete = False
+                    break
+                texts.append(record.pop("text"))
+                metadata.append(record)
+        
+        self.texts = texts
+        self._set_metadata_from_dicts(metadata)
+        self._saved_chunks = len(texts) if complete else None
+    
+    def flush(self):
+        """Save to disk if there are unsaved changes."""
+        with self._save_lock:
+            if self._dirty:
+                self.save()
+    
+    async def autosave(self, interval: float = 2.0):
+        """
+        Periodically flush unsaved changes in a worker thread.
+        
+        Run as a background task; writes are batched so requests never wait
+        on serialization.
+        
+        Args:
+            interval: Seconds between flushes
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if self._dirty:
+                try:
+                    await loop.run_in_executor(None, self.flush)
+                except Exception as e:
+                    print(f"Warning: Could not save index: {e}")
     
     def load(self):
-        """Load the FAISS index and associated data from disk."""
-        index_file = self.index_path.replace('.pkl', '.index')
+        """
+        Load the FAISS index and associated data from disk.
+        
+        A writable database that can't be read starts empty. A read-only one
+        never changes the files: it retries while another process's save
+        changes them under it, then raises.
         
-        if os.path.exists(index_file) and os.path.exists(self.index_path):
+        Raises:
+            ValueError: If the saved index and texts don't match and the index
+                can't be rebuilt from saved embeddings, or a read-only
+                database can't be loaded
+        """
+        for attempt in range(READ_ONLY_LOAD_ATTEMPTS if self.read_only else 1):
+            if attempt:
+                time.sleep(0.1 * attempt)
+            error = None
             try:
-                # Load index
-                self.index = faiss.read_index(index_file)
-                
-                # Load texts, metadata, and embeddings
-                with open(self.index_path, 'rb') as f:
-                    data = pickle.load(f)
-                    self.texts = data.get('texts', [])
-                    self.metadata = data.get('metadata', [])
-                    self.embeddings = data.get('embeddings', [])
-                    self.dimension = data.get('dimension', self.dimension)
-                    
-                    # Handle old database files that don't have embeddings stored
-                    # If embeddings are missing but we have texts, create empty list
-                    # (embeddings will be regenerated on next deletion if needed)
-                    if not self.embeddings and self.texts:
-                        self.embeddings = [None] * len(self.texts)
+                mismatch = self._load_files()
             except Exception as e:
-                print(f"Warning: Could not load existing index: {e}")
-                # Reset to empty index
-                self.index = faiss.IndexFlatL2(self.dimension)
-                self.texts = []
-                self.metadata = []
-                self.embeddings = []
+                error = e
+                mismatch = None
+            if error is None and (mismatch is None or not self.read_only):
+                break
+        
+        if error is not None:
+            if self.read_only:
+                raise ValueError(f"Could not load {self.index_path}: {error}") from error
+            print(f"Warning: Could not load existing index: {error}")
+            # Reset to empty index
+            self.index = self._new_index()
+            self._mapped_index = None
+            self.texts = []
+            self._set_metadata_from_dicts([])
+            self.embeddings = np.empty((0, self.dimension), dtype=np.float32)
+            self._saved_chunks = None
+            self._saved_vectors = None
+        elif mismatch:
+            raise ValueError(mismatch)
+    
+    def _load_files(self) -> Optional[str]:
+        """
+        Read the database files into memory (see load()).
+        
+        Returns:
+            A description of the mismatch if the saved index and texts don't
+            match and the index can't be rebuilt, else None
+        """
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path, 'rb') as f:
+            data = pickle.load(f)
+        self.dimension = data.get('dimension', self.dimension)
+        
+        # Files committed by a save that hasn't replaced them all yet
+        directory = os.path.dirname(self.index_path)
+        pending = [os.path.join(directory, name) for name in data.get('replacing', ())]
+        if pending and not self.read_only:
+            # The save was interrupted: finish it
+            self._replace_files(pending)
+            self._write_header()
+            pending = []
+        
+        # A read-only database reads pending files from their temporary
+        # names, leaving the renames to the writer
+        index_file = self._committed_file(self._index_file, pending)
+        chunks_file = self._committed_file(self._chunks_file, pending)
+        emb_file = self._committed_file(self._emb_file, pending)
+        if not os.path.exists(index_file):
+            return None
+        
+        # The vectors of the log are in the pending files
+        wal = None if pending else self._read_wal()
+        mismatch = None
+        
+        # Load index, memory-mapped so pages are read on first use. Not
+        # when vectors from the log must be added, the index goes to
+        # the GPU, or on Windows (where saves can't replace mapped files).
+        mmap = self.read_only or (not self.use_gpu and os.name != 'nt')
+        if mmap and wal is None:
+            mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+            self.index = faiss.read_index(index_file, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+            self._mapped_index = self.index
+        else:
+            self.index = self._to_device(faiss.read_index(index_file))
+        
+        # Load texts, metadata, and embeddings
+        if os.path.exists(chunks_file):
+            self._load_chunks(chunks_file)
+        else:
+            # Older files keep texts and metadata in the pickle
+            # (rewritten as .jsonl on the next save)
+            self.texts = data.get('texts', [])
+            self._saved_chunks = None
+            if 'filenames' in data:
+                self.filenames = [sys.intern(f) if f is not None else None for f in data['filenames']]
+                self.chunk_indices = np.asarray(data['chunk_indices'], dtype=np.int32)
+                self.total_chunks = np.asarray(data['total_chunks'], dtype=np.int32)
+                self._index_files()
+            else:
+                # Oldest files store a list of metadata dicts
+                self._set_metadata_from_dicts(data.get('metadata', []))
+        
+        # Handle old database files that don't have (all) embeddings
+        # stored: keep an empty matrix. Older files store them in the
+        # pickle, as an array or a list of lists.
+        if os.path.exists(emb_file):
+            # Rows are never modified in place: appends and deletes copy
+            embeddings = np.load(emb_file, mmap_mode='r' if mmap else None)
+        else:
+            embeddings = data.get('embeddings')
+        
+        # Replay vectors appended since the index was last written,
+        # if the log extends this index and its stored embeddings
+        saved_vectors = self.index.ntotal
+        if wal is not None:
+            base, logged = wal
+            if (base == self.index.ntotal and isinstance(embeddings, np.ndarray)
+                    and len(embeddings) == base):
+                logged = logged[:max(len(self.texts) - base, 0)]
+                self.index.add(logged)
+                embeddings = np.concatenate([embeddings, logged])
+            else:
+                self._saved_chunks = None  # Stale log: rewrite everything
+        
+        # Drop texts whose vectors were never saved (interrupted save)
+        saved_embeddings = isinstance(embeddings, np.ndarray) and len(embeddings) == len(self.texts)
+        if len(self.texts) > self.index.ntotal and not saved_embeddings:
+            count = self.index.ntotal
+            self.texts = self.texts[:count]
+            self.filenames = self.filenames[:count]
+            self.chunk_indices = self.chunk_indices[:count]
+            self.total_chunks = self.total_chunks[:count]
+            self._index_files()
+            self._saved_chunks = None
+        
+        if (embeddings is None or len(embeddings) != len(self.texts)
+                or (isinstance(embeddings, list) and any(e is None for e in embeddings))):
+            self.embeddings = np.empty((0, self.dimension), dtype=np.float32)
+        else:
+            self.embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dimension)
+        
+        # A save interrupted between the embeddings and the index
+        # leaves an out-of-date index: rebuild it from the embeddings
+        if saved_embeddings and self.index.ntotal != len(self.texts):
+            self.index = self._new_index(self.embeddings)
+            self.index.add(self.embeddings)
+            self._saved_chunks = None
+        
+        # Vector ids are chunk positions: never serve an index whose
+        # vectors belong to other texts
+        if self.index.ntotal != len(self.texts):
+            mismatch = (f"The index in {self._index_file} has {self.index.ntotal} vectors "
+                        f"but {len(self.texts)} texts were saved, and there are no "
+                        f"embeddings to rebuild it from")
+        
+        consistent = len(self.embeddings) == len(self.texts) == self.index.ntotal
+        self._saved_vectors = saved_vectors if consistent else None
+        
+        # Databases saved before the switch to cosine similarity hold
+        # raw vectors in an L2 index: normalize and rebuild if we can
+        if (self.index.metric_type != faiss.METRIC_INNER_PRODUCT
+                and len(self.embeddings) == self.index.ntotal):
+            self.embeddings = np.array(self.embeddings, dtype=np.float32)
+            faiss.normalize_L2(self.embeddings)
+            self.index = self._new_index(self.embeddings)
+            self.index.add(self.embeddings)
+            self._saved_vectors = None
+        elif self._legacy_l2_index():
+            print(f"Warning: {self._index_file} is an L2 index without stored embeddings; "
+                  f"search scores are approximate. Clear the database and upload the "
+                  f"files again to re-index it.")
+        
+        return mismatch
+    
+    def _committed_file(self, path: str, pending: List[str]) -> str:
+        """
+        Path to read a database file from.
+        
+        Args:
+            path: The file
+            pending: Files a save has committed but not yet renamed into place
+        
+        Returns:
+            The committed temporary file if path is pending, else path
+        """
+        if path in pending and os.path.exists(path + '.tmp'):
+            return path + '.tmp'
+        return path
+    
+    def _set_metadata_from_dicts(self, metadata: List[dict]):
+        """Replace the metadata columns with the contents of metadata dictionaries."""
+        self.filenames = [sys.intern(m["filename"]) if m.get("filename") else None for m in metadata]
+        self.chunk_indices = np.array([m.get("chunk_index", 0) for m in metadata], dtype=np.int32)
+        self.total_chunks = np.array([m.get("total_chunks", 0) for m in metadata], dtype=np.int32)
+        self._index_files()
+    
+    def _index_files(self):
+        """Rebuild the per-file summary from the metadata columns."""
+        self._file_info = {}
+        for filename, chunk_index in zip(self.filenames, self.chunk_indices.tolist()):
+            if filename:
+                if filename not in self._file_info:
+                    self._file_info[filename] = {
+                        "filename": filename,
+                        "chunks": 0,
+                        "first_chunk_index": chunk_index
+                    }
+                self._file_info[filename]["chunks"] += 1
     
     def delete_documents_by_filename(self, filename: str) -> int:
         """
@@ -158,74 +873,59 @@ class VectorDB:
         if self.index.ntotal == 0:
             return 0
         
-        # Find indices of all chunks with matching filename
-        indices_to_remove = set()
-        for i, meta in enumerate(self.metadata):
-            if meta.get("filename") == filename:
-                indices_to_remove.add(i)
-        
-        if not indices_to_remove:
-            return 0
-        
-        # Check if we have embeddings stored (newer database format)
-        has_embeddings = self.embeddings and all(e is not None for e in self.embeddings if self.embeddings)
-        has_some_embeddings = self.embeddings and any(e is not None for e in self.embeddings)
-        
-        if not has_some_embeddings:
-            # Old database without stored embeddings - need to rebuild index differently
-            # For now, we'll just remove from texts/metadata but keep index structure
-            # This is not ideal but maintains functionality for old databases
-            new_texts = []
-            new_metadata = []
-            new_embeddings = []
+        self._check_writable()
+        with self._lock:
+            if filename not in self._file_info:
+                return 0
             
-            # Remove items in reverse order to preserve indices
-            indices_to_remove_sorted = sorted(indices_to_remove, reverse=True)
-            for idx in indices_to_remove_sorted:
-                if idx < len(self.texts):
-                    self.texts.pop(idx)
-                if idx < len(self.metadata):
-                    self.metadata.pop(idx)
-                if idx < len(self.embeddings):
-                    self.embeddings.pop(idx)
+            # Find all chunks with matching filename (one C loop over the column)
+            remove = np.asarray(self.filenames, dtype=object) == filename
+            removed = int(remove.sum())
             
-            # Note: FAISS index still contains old entries, but they won't be accessible
-            # This is acceptable for now - full rebuild would require re-embedding
+            if removed == 0:
+                return 0
             
-            # Save changes
-            self.save()
-            return len(indices_to_remove)
-        
-        # Create new index, texts, metadata, and embeddings without deleted chunks
-        # Note: FAISS doesn't support direct deletion, so we rebuild
-        new_index = faiss.IndexFlatL2(self.dimension)
-        new_texts = []
-        new_metadata = []
-        new_embeddings = []
-        
-        for i in range(len(self.texts)):
-            if i not in indices_to_remove:
-                # Re-add to new index using stored embedding
-                if i < len(self.embeddings) and self.embeddings[i] is not None:
-                    embedding = np.array([self.embeddings[i]]).astype('float32')
-                    new_index.add(embedding)
-                    new_embeddings.append(self.embeddings[i])
-                else:
-                    # Missing embedding - skip for now
-                    new_embeddings.append(None)
-                new_texts.append(self.texts[i])
-                new_metadata.append(self.metadata[i])
-        
-        # Replace with new data
-        self.index = new_index
-        self.texts = new_texts
-        self.metadata = new_metadata
-        self.embeddings = new_embeddings
-        
-        # Save changes
-        self.save()
-        
-        return len(indices_to_remove)
+            keep = ~remove
+            
+            # Check if we have embeddings stored (newer database format)
+            has_embeddings = len(self.embeddings) == len(self.texts)
+            in_place = isinstance(self.index, faiss.IndexFlatCodes) and self.index.ntotal == len(self.texts)
+            if not in_place and not has_embeddings:
+                # Old database without stored embeddings: the vectors can't be
+                # renumbered, and dropping only the texts would shift them
+                raise ValueError("This database has no stored embeddings, so chunks can't be "
+                                 "deleted from its index. Clear it and upload the files again.")
+            
+            if in_place:
+                # Flat (and SQ8) indexes delete in place: the remaining vectors are shifted
+                # down, so vector ids stay equal to chunk positions
+                self._promote_index()
+                self.index.remove_ids(faiss.IDSelectorBatch(np.flatnonzero(remove).astype(np.int64)))
+                if has_embeddings:
+                    self.embeddings = self.embeddings[keep]
+            elif has_embeddings:
+                # Rebuild index without deleted chunks
+                # Note: HNSW doesn't support deletion and IVF-PQ (or GPU)
+                # indexes don't renumber the remaining vectors, so we rebuild
+                new_embeddings = self.embeddings[keep]
+                new_index = self._new_index(new_embeddings)
+                new_index.add(new_embeddings)  # Single batched add of surviving vectors
+                
+                self.index = new_index
+                self.embeddings = new_embeddings
+            
+            # Drop deleted chunks from texts and metadata
+            self.texts = list(itertools.compress(self.texts, keep))
+            self.filenames = list(itertools.compress(self.filenames, keep))
+            self.chunk_indices = self.chunk_indices[keep]
+            self.total_chunks = self.total_chunks[keep]
+            del self._file_info[filename]
+            
+            self._saved_chunks = None  # The .jsonl file must be rewritten
+            self._generation += 1
+            self._dirty = True
+            
+            return removed
     
     def get_filenames(self) -> List[str]:
         """
@@ -234,12 +934,7 @@ class VectorDB:
         Returns:
             List of unique filenames
         """
-        filenames = set()
-        for meta in self.metadata:
-            filename = meta.get("filename")
-            if filename:
-                filenames.add(filename)
-        return sorted(list(filenames))
+        return sorted(self._file_info)
     
     def get_file_info(self) -> List[dict]:
         """
@@ -248,34 +943,24 @@ class VectorDB:
         Returns:
             List of dictionaries with file information
         """
-        file_info = {}
-        for meta in self.metadata:
-            filename = meta.get("filename")
-            if filename:
-                if filename not in file_info:
-                    file_info[filename] = {
-                        "filename": filename,
-                        "chunks": 0,
-                        "first_chunk_index": None
-                    }
-                file_info[filename]["chunks"] += 1
-                if file_info[filename]["first_chunk_index"] is None:
-                    file_info[filename]["first_chunk_index"] = meta.get("chunk_index", 0)
-        
-        return list(file_info.values())
+        return [dict(info) for info in self._file_info.values()]
     
     def clear(self):
         """Clear all documents from the database."""
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.texts = []
-        self.metadata = []
-        self.embeddings = []
-        # Remove saved files
-        if os.path.exists(self.index_path):
-            os.remove(self.index_path)
-        index_file = self.index_path.replace('.pkl', '.index')
-        if os.path.exists(index_file):
-            os.remove(index_file)
+        self._check_writable()
+        with self._save_lock, self._lock:
+            self.index = self._new_index()
+            self.texts = []
+            self._set_metadata_from_dicts([])
+            self.embeddings = np.empty((0, self.dimension), dtype=np.float32)
+            self._dirty = False
+            self._saved_chunks = None
+            self._saved_vectors = None
+            self._generation += 1
+            # Remove saved files
+            for path in (self.index_path, self._index_file, self._emb_file, self._chunks_file, self._wal_file):
+                if os.path.exists(path):
+                    os.remove(path)
     
     def size(self) -> int:
         """Get the number of documents in the database."""